@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import glob
+import os
+
+from converter import writeFile
+
+INPUT_EXTENSIONS = ('.musicxml', '.xml', '.mxl')
+OUTPUT_EXTENSION = '.txt'
+
+class BatchTask:
+
+    def __init__(self, input_file, output_file, error=None):
+        self.input_file = input_file
+        self.output_file = output_file
+        self.error = error  # set when the task cannot run
+
+class BatchResult:
+
+    def __init__(self, task, error=None, cached=None):
+        self.task = task
+        self.error = error  # None on success, otherwise 'ErrorType: message'
+        self.cached = cached  # None when running without a cache
+
+    def isSuccess(self):
+        return self.error is None
+
+def isInputFile(filename):
+    return filename.lower().endswith(INPUT_EXTENSIONS)
+
+def outputName(relative_path):
+    return os.path.splitext(relative_path)[0] + OUTPUT_EXTENSION
+
+def createTasks(inputs, output_dir):
+    """ expand files, directories and glob patterns into a list of BatchTask
+
+    Files found under a directory keep their path relative to it, everything
+    else is written with its base name directly into output_dir. An input
+    whose output file is already written by another one gets a task with
+    an error instead of overwriting it.
+    """
+    tasks = []
+    seen = set()
+    outputs = {}  # output file -> input file writing it
+
+    def addTask(input_file, relative_path):
+        key = os.path.abspath(input_file)
+        if key not in seen:
+            seen.add(key)
+            output_file = os.path.join(output_dir, outputName(relative_path))
+            output_key = os.path.normcase(os.path.abspath(output_file))
+            other = outputs.setdefault(output_key, input_file)
+            error = None
+            if other != input_file:
+                error = f'OutputCollision: {output_file} is the output of {other}'
+            tasks.append(BatchTask(input_file, output_file, error))
+
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for dirpath, dirnames, filenames in os.walk(pattern):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if isInputFile(name):
+                        path = os.path.join(dirpath, name)
+                        addTask(path, os.path.relpath(path, pattern))
+        elif glob.has_magic(pattern):
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path) and isInputFile(path):
+                    addTask(path, os.path.basename(path))
+        else:
+            addTask(pattern, os.path.basename(pattern))
+    return tasks
+
+def runTask(task, options, cache_config=None):
+    if task.error is not None:
+        return BatchResult(task, task.error)
+    cached = None
+    try:
+        output_dir = os.path.dirname(task.output_file)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        if cache_config is None:
+            with open(task.output_file, 'w', encoding='utf-8') as f:
+                writeFile(task.input_file, f, **options)
+        else:
+            from cache import ConversionCache
+            cache = ConversionCache(*cache_config)
+            text = cache.convert(task.input_file, **options)
+            cached = cache.hits > 0
+            with open(task.output_file, 'w', encoding='utf-8') as f:
+                f.write(text)
+    except Exception as e:  # report the failure and keep the batch going
+        if cache_config is None and os.path.exists(task.output_file):
+            os.remove(task.output_file)  # do not leave partial output behind
+        return BatchResult(task, f'{type(e).__name__}: {e}', cached)
+    return BatchResult(task, cached=cached)
+
+def runBatch(tasks, options, workers=0, cache_config=None):
+    """ convert all tasks and return their BatchResult in the same order
+
+    cache_config is an optional (directory, max_bytes) tuple for a
+    ConversionCache shared by all workers.
+    """
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(tasks))
+    if workers <= 1:
+        return [runTask(task, options, cache_config) for task in tasks]
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(runTask, task, options, cache_config)
+                   for task in tasks]
+        return [future.result() for future in futures]
+
+def printSummary(results, file=None):
+    """ print one line per result and a total; return whether all succeeded """
+    failed = 0
+    for result in results:
+        task = result.task
+        if result.isSuccess():
+            print(f'ok: {task.input_file} -> {task.output_file}', file=file)
+        else:
+            failed += 1
+            print(f'error: {task.input_file}: {result.error}', file=file)
+    print(f'{len(results)} run, {len(results) - failed} converted, '
+          f'{failed} failed', file=file)
+    if any(result.cached is not None for result in results):
+        hits = sum(1 for result in results if result.cached)
+        print(f'cache: {hits} hits, {len(results) - hits} misses', file=file)
+    return failed == 0
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+import argparse
+import copy
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from lxml import etree
+
+from reader import READER_BACKENDS, MusicXMLReader
+from writer import createWriter, getGrammars
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_CASE_DIR = os.path.join(SOURCE_DIR, 'tests')
+SCALED_CASE = 'case7.musicxml'
+STAGES = ('parse', 'measures', 'generate')
+STARTUP_CASE = 'case1.musicxml'
+STARTUP_KEYS = ('import_ms', 'convert_ms')
+# imported on demand only, so that short conversions do not pay for them
+DEFERRED_MODULES = ('zipfile', 'copy', 'batch', 'cache', 'server',
+                    'concurrent.futures', 'http.server', 'cProfile')
+
+def getPeakRSS():
+    """ return the peak resident set size of this process in KB """
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024  # reported in bytes on macOS
+    return peak
+
+def writeScaledCase(source, num_measures, filename):
+    """ write a copy of source whose parts are repeated to num_measures """
+    tree = etree.parse(source)
+    for part in tree.getroot().iterchildren('part'):
+        measures = list(part.iterchildren('measure'))
+        for i in range(len(measures), num_measures):
+            measure = copy.deepcopy(measures[i % len(measures)])
+            measure.set('number', str(i + 1))
+            part.append(measure)
+    tree.write(filename, xml_declaration=True, encoding='UTF-8')
+
+def runCase(filename, grammar, repeat, backend='tree'):
+    """ time every stage of a conversion; keep the fastest of repeat runs """
+    timings = {stage: float('inf') for stage in STAGES}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        reader = MusicXMLReader(filename, backend=backend)
+        parsed = time.perf_counter()
+        part_measures = [list(reader.iterMeasures(part))
+                         for part in reader.getPartIdList()]
+        measured = time.perf_counter()
+        writer = createWriter(grammar)
+        writer.generateHeader(reader)
+        writer.generateBody(reader)
+        generated = time.perf_counter()
+
+        timings['parse'] = min(timings['parse'], parsed - start)
+        timings['measures'] = min(timings['measures'], measured - parsed)
+        timings['generate'] = min(timings['generate'], generated - measured)
+
+    num_measures = sum(len(measures) for measures in part_measures)
+    num_notes = sum(len(measure.getNotes())
+                    for measures in part_measures for measure in measures)
+    total = sum(timings.values())
+    result = {f'{stage}_ms': round(timings[stage] * 1000, 3) for stage in STAGES}
+    result.update({
+        'total_ms': round(total * 1000, 3),
+        'measures': num_measures,
+        'notes': num_notes,
+        'notes_per_sec': round(num_notes / total) if total > 0 else None,
+        'peak_rss_kb': getPeakRSS(),
+    })
+    return result
+
+def runIsolated(function, *args):
+    """ call function in a fresh process, keeping its memory out of ours
+
+    Peak RSS survives fork and exec, so the scaled case is also written in
+    a separate process to keep the peak of the later cases their own.
+    """
+    context = multiprocessing.get_context('spawn')  # do not inherit our RSS
+    with context.Pool(1) as pool:
+        return pool.apply(function, args)
+
+def runCaseIsolated(filename, grammar, repeat, backend='tree'):
+    """ run a case in a fresh process so that peak RSS is per case """
+    return runIsolated(runCase, filename, grammar, repeat, backend)
+
+def getImportedModules(module='converter'):
+    """ return the modules a fresh interpreter loads to import module """
+    code = f'import sys; import {module}; print("\\n".join(sorted(sys.modules)))'
+    output = subprocess.run([sys.executable, '-c', code], cwd=SOURCE_DIR,
+                            stdout=subprocess.PIPE, universal_newlines=True,
+                            check=True).stdout
+    return output.split()
+
+def measureImportTime(module='converter'):
+    """ return the milliseconds a fresh interpreter spends importing module """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             f'import {module}'], cwd=SOURCE_DIR,
+                            stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True).stderr
+    for line in output.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module and \
+                not fields[2].startswith('  '):
+            return int(fields[1]) / 1000
+    raise ValueError(f'no import time reported for {module}')
+
+def measureStartup(repeat=5, case_dir=TEST_CASE_DIR):
+    """ time the import and a whole short conversion in fresh interpreters """
+    command = [sys.executable, os.path.join(SOURCE_DIR, 'converter.py'),
+               os.path.join(case_dir, STARTUP_CASE)]
+    import_ms = convert_ms = float('inf')
+    for _ in range(repeat):
+        import_ms = min(import_ms, measureImportTime())
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        convert_ms = min(convert_ms, (time.perf_counter() - start) * 1000)
+    return {
+        'import_ms': round(import_ms, 3),
+        'convert_ms': round(convert_ms, 3),
+        'modules': len(getImportedModules()),
+    }
+
+def listCases(case_dir):
+    files = glob.glob(os.path.join(case_dir, '*.musicxml'))
+    files += glob.glob(os.path.join(case_dir, '*.mxl'))
+    return sorted(files)
+
+def runBenchmark(grammar='jianpu99', repeat=3, scale=10000,
+                 case_dir=TEST_CASE_DIR, isolate=True, startup=True,
+                 backend='tree'):
+    run = runCaseIsolated if isolate else runCase
+    cases = {}
+    for filename in listCases(case_dir):
+        cases[os.path.basename(filename)] = run(filename, grammar, repeat,
+                                                backend)
+
+    if scale > 0:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            name = f'{os.path.splitext(SCALED_CASE)[0]}x{scale}.musicxml'
+            filename = os.path.join(tmpdir, name)
+            source = os.path.join(case_dir, SCALED_CASE)
+            if isolate:
+                runIsolated(writeScaledCase, source, scale, filename)
+            else:
+                writeScaledCase(source, scale, filename)
+            cases[name] = run(filename, grammar, 1, backend)
+
+    results = {
+        'python': platform.python_version(),
+        'grammar': grammar,
+        'backend': backend,
+        'cases': cases,
+    }
+    if startup:
+        results['startup'] = measureStartup(max(repeat, 3), case_dir)
+    return results
+
+def compareResults(baseline, current, threshold):
+    """ return a message for every stage slower than baseline by threshold % """
+    regressions = []
+    for name, result in current['cases'].items():
+        base = baseline.get('cases', {}).get(name)
+        if base is None:
+            continue
+        for key in [f'{stage}_ms' for stage in STAGES] + ['total_ms']:
+            old, new = base.get(key), result.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) * 100 / old
+            if change > threshold:
+                regressions.append(f'{name}: {key} {old} -> {new} ({change:+.1f}%)')
+
+    base, result = baseline.get('startup'), current.get('startup')
+    if base and result:
+        for key in STARTUP_KEYS:
+            old, new = base.get(key), result.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) * 100 / old
+            if change > threshold:
+                regressions.append(f'startup: {key} {old} -> {new} ({change:+.1f}%)')
+    return regressions
+
+def checkStartupBudget(results, budget_ms):
+    """ return a message if a short conversion took longer than budget_ms """
+    startup = results.get('startup')
+    if startup and startup['convert_ms'] > budget_ms:
+        return f'startup: convert_ms {startup["convert_ms"]} exceeds {budget_ms}'
+    return None
+
+def parseArguments():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--grammar', choices=getGrammars(),
+                        default=getGrammars()[0],
+                        help="Which grammar to use in writing")
+    parser.add_argument('--backend', choices=READER_BACKENDS,
+                        default=READER_BACKENDS[0],
+                        help="Which reader backend to benchmark")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Number of runs per case; the fastest is kept")
+    parser.add_argument('--scale', type=int, default=10000,
+                        help=f"Number of measures of the scaled-up {SCALED_CASE}"
+                             " (0 disables it)")
+    parser.add_argument('--output', help="Write the results to this file")
+    parser.add_argument('--baseline', help="Compare against stored results")
+    parser.add_argument('--threshold', type=float, default=20,
+                        help="Maximal allowed slowdown against the baseline in %%")
+    parser.add_argument('--startup_budget', type=float,
+                        help="Fail when converting the smallest case in a "
+                             "fresh interpreter takes longer (ms)")
+    parser.add_argument('--no_startup', default=False, action='store_true',
+                        help="Skip the startup measurements")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArguments()
+    results = runBenchmark(args.grammar, args.repeat, args.scale,
+                           startup=not args.no_startup, backend=args.backend)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compareResults(baseline, results, args.threshold)
+        for message in regressions:
+            print(f'regression: {message}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+    if args.startup_budget is not None:
+        message = checkStartupBudget(results, args.startup_budget)
+        if message:
+            print(f'regression: {message}', file=sys.stderr)
+            sys.exit(1)
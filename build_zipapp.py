@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import py_compile
+import shutil
+import sys
+import tempfile
+import zipapp
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODULES = ('converter', 'reader', 'eventreader', 'writer', 'profiling',
+           'batch', 'cache', 'incremental', 'watch', 'server')
+MAIN = 'import sys\nimport converter\nsys.exit(converter.main())\n'
+
+def stageModules(staging_dir):
+    """ copy the modules with bytecode that zipimport can use as it is
+
+    zipimport cannot write bytecode caches, so the archive carries legacy
+    .pyc files next to the sources. Source times are rounded to even
+    seconds, the resolution of zip timestamps, so that the .pyc files
+    stay valid for them.
+    """
+    mtime = int(os.path.getmtime(os.path.join(SOURCE_DIR, 'converter.py'))) // 2 * 2
+    for module in MODULES:
+        source = os.path.join(staging_dir, module + '.py')
+        shutil.copyfile(os.path.join(SOURCE_DIR, module + '.py'), source)
+        os.utime(source, (mtime, mtime))
+        py_compile.compile(source, cfile=source + 'c', doraise=True)
+    with open(os.path.join(staging_dir, '__main__.py'), 'w') as f:
+        f.write(MAIN)
+
+def buildZipapp(target, interpreter='/usr/bin/env python3'):
+    """ write converter.py and its modules as a single executable file
+
+    lxml is not bundled and has to be installed for the interpreter.
+    """
+    with tempfile.TemporaryDirectory() as staging_dir:
+        stageModules(staging_dir)
+        zipapp.create_archive(staging_dir, target, interpreter=interpreter)
+
+def parseArguments():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--output', default='musicxml_to_jianpu.pyz',
+                        help="Path of the archive to write")
+    parser.add_argument('--python', default='/usr/bin/env python3',
+                        help="Interpreter written in the shebang line")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArguments()
+    buildZipapp(args.output, args.python)
+    print(f'wrote {args.output}', file=sys.stderr)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+from converter import convertFile
+from reader import READER_VERSION, openMusicXML
+from writer import createWriter
+
+CONVERTER_VERSION = '1'  # bump whenever the generated output changes
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+CACHE_SUFFIX = '.txt'
+SCORE_SUFFIX = '.score'
+STATE_SUFFIX = '.state'
+
+def readMusicXMLBytes(filename):
+    """ return the MusicXML document bytes, unpacking compressed files """
+    with openMusicXML(filename) as f:
+        return f.read()
+
+def describeOptions(grammar, staff=1, ignore_key=False, notes_per_line=0):
+    """ return everything but the input that affects the output, as JSON """
+    writer = createWriter(grammar,
+                          ignore_key=ignore_key,
+                          notes_per_line=notes_per_line)
+    return json.dumps({
+        'version': CONVERTER_VERSION,
+        'grammar': grammar,
+        'staff': staff,
+        'writer': writer.getSettings(),
+    }, sort_keys=True)
+
+def computeCacheKey(data, grammar, staff=1, ignore_key=False,
+                    notes_per_line=0, **kwds):
+    """ hash the document bytes with everything that affects the output """
+    description = describeOptions(grammar, staff, ignore_key, notes_per_line)
+    digest = hashlib.sha256(hashlib.sha256(data).digest())
+    digest.update(description.encode('utf-8'))
+    return digest.hexdigest()
+
+def computeFileDigest(filename):
+    """ return the sha256 digest of a file, read in chunks """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+def computeScoreKey(filename, keep_chords=False, data=None):
+    """ hash the input file, or the document bytes in data when given, with
+    everything that affects the parsed score """
+    description = json.dumps({
+        'version': READER_VERSION,
+        'keep_chords': bool(keep_chords),
+    }, sort_keys=True)
+    if data is not None:
+        digest = hashlib.sha256(hashlib.sha256(data).digest())
+    else:
+        digest = hashlib.sha256(computeFileDigest(filename))
+    digest.update(description.encode('utf-8'))
+    return digest.hexdigest()
+
+def computeStateKey(filename, grammar, staff=1, ignore_key=False,
+                    notes_per_line=0, **kwds):
+    """ hash the path of an input with everything that affects the output
+
+    Unlike the other keys, the content is left out: the entry of an input
+    is replaced whenever it is converted again.
+    """
+    description = json.dumps({
+        'reader': READER_VERSION,
+        'path': os.path.abspath(filename),
+        'options': describeOptions(grammar, staff, ignore_key, notes_per_line),
+    }, sort_keys=True)
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+class FileCache:
+    """ on-disk cache of entries with least-recently-used eviction
+
+    Entries are files named after their key; the modification time
+    records the last use, so several processes can share a directory.
+    """
+
+    SUFFIX = None
+
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_SIZE):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _getPath(self, key):
+        return os.path.join(self._directory, key + self.SUFFIX)
+
+    def get(self, key):
+        path = self._getPath(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.decode(data)
+
+    def put(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.encode(value))
+        os.replace(tmp_path, self._getPath(key))
+        self.evict()
+
+    def encode(self, value):
+        return value
+
+    def decode(self, data):
+        return data
+
+    def invalidate(self, key):
+        try:
+            os.remove(self._getPath(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """ remove every entry of this cache from the directory """
+        for entry in os.scandir(self._directory):
+            if entry.name.endswith(self.SUFFIX):
+                self.invalidate(entry.name[:-len(self.SUFFIX)])
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self._directory):
+            if entry.name.endswith(self.SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self._max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # evicted by another process
+            total -= size
+
+    def getStats(self):
+        return f'cache: {self.hits} hits, {self.misses} misses'
+
+class ConversionCache(FileCache):
+    """ converted text of MusicXML documents, keyed by computeCacheKey() """
+
+    SUFFIX = CACHE_SUFFIX
+
+    def encode(self, text):
+        return text.encode('utf-8')
+
+    def decode(self, data):
+        return data.decode('utf-8')
+
+    def convert(self, input_file, **options):
+        """ return the converted text of input_file, parsing only on a miss """
+        key = computeCacheKey(readMusicXMLBytes(input_file), **options)
+        text = self.get(key)
+        if text is None:
+            text = convertFile(input_file, **options)
+            self.put(key, text)
+        return text
+
+
+class PickleCache(FileCache):
+    """ cache of Python objects
+
+    Entries are pickles: only share the directory with trusted processes.
+    """
+
+    def encode(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+    def get(self, key):
+        try:
+            return FileCache.get(self, key)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            # truncated, or written by an incompatible reader
+            self.hits -= 1
+            self.misses += 1
+            self.invalidate(key)
+            return None
+
+class ScoreCache(PickleCache):
+    """ parsed scores of MusicXMLReader, keyed by computeScoreKey()
+
+    The scores do not depend on the writer options, so one entry serves
+    every grammar, staff and layout.
+    """
+
+    SUFFIX = SCORE_SUFFIX
+
+    def computeKey(self, filename, keep_chords=False, data=None):
+        return computeScoreKey(filename, keep_chords, data)
+
+class StateCache(PickleCache):
+    """ incremental.ConversionState of inputs, keyed by computeStateKey() """
+
+    SUFFIX = STATE_SUFFIX
@@ -1,35 +1,286 @@
 #!/usr/bin/env python3
 
 import argparse
+import io
+import sys
 
-from reader import MusicXMLReader, MusicXMLParseError
+from reader import READER_BACKENDS, MusicXMLReader, MusicXMLParseError
 from writer import WriterError, createWriter, getGrammars
 
+def staffArgument(value):
+    if value == 'all':
+        return value
+    return int(value)
+
 def parseArguments():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('input_file', help="input file in MusicXML format")
+    parser.add_argument('input_files', nargs='*', metavar='input_file',
+                        help="input file in MusicXML format; several files, "
+                             "directories or glob patterns can be given "
+                             "together with --output_dir")
     parser.add_argument('--grammar', choices=getGrammars(),
                         default=getGrammars()[0],
                         help="Which grammar to use in writing")
-    parser.add_argument('--staff', type=int, default=1,
-                        help="Which staff to convert")
+    parser.add_argument('--staff', type=staffArgument, default=1,
+                        help="Which staff to convert, or 'all' to convert "
+                             "every staff in one pass")
     parser.add_argument('--ignore_key', default=False, action='store_true',
                         help="Whethere to ignore key signature")
     parser.add_argument('--notes_per_line', type=int, default=0,
                         help="Expected number of notes per line if non-zero")
-    return parser.parse_args()
+    parser.add_argument('--streaming', default=False, action='store_true',
+                        help="Parse the input incrementally instead of "
+                             "keeping the whole document in memory")
+    parser.add_argument('--backend', choices=READER_BACKENDS,
+                        default=READER_BACKENDS[0],
+                        help="How to parse the input: build an element tree, "
+                             "or decode parser events without one")
+    parser.add_argument('--decode_workers', type=int, default=1,
+                        help="Number of processes decoding the measures of a "
+                             "single input (1 decodes them in this process)")
+    parser.add_argument('--render_workers', type=int, default=1,
+                        help="Number of processes rendering the lines of a "
+                             "single input (1 renders them in this process)")
+    parser.add_argument('--output_dir',
+                        help="Convert all inputs in batch mode and write the "
+                             "results into this directory")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Number of worker processes in batch mode or of "
+                             "the service (0 means one per CPU)")
+    parser.add_argument('--cache_dir',
+                        help="Reuse converted output stored in this directory "
+                             "for identical inputs and options")
+    parser.add_argument('--cache_size', type=int, default=256,
+                        help="Maximal size of the cache directory in MB")
+    parser.add_argument('--cache_stats', default=False, action='store_true',
+                        help="Print cache hits and misses to stderr")
+    parser.add_argument('--score_cache_dir',
+                        help="Reuse parsed scores stored in this directory, "
+                             "whatever the grammar, staff or layout options")
+    parser.add_argument('--incremental_dir',
+                        help="Keep the rendered measures of the input in this "
+                             "directory and only render the changed ones on "
+                             "the next conversion")
+    parser.add_argument('--clear_cache', default=False, action='store_true',
+                        help="Empty the cache directories before converting")
+    parser.add_argument('--watch', default=False, action='store_true',
+                        help="Convert the inputs next to them, then again "
+                             "whenever they are modified, until interrupted")
+    parser.add_argument('--watch_interval', type=float, default=0.5,
+                        help="Seconds between two checks of the watched "
+                             "inputs")
+    parser.add_argument('--profile', default=False, action='store_true',
+                        help="Print stage timings and counters to stderr")
+    parser.add_argument('--pstats',
+                        help="Also write cProfile statistics to this file "
+                             "(implies --profile)")
+    parser.add_argument('--serve', default=False, action='store_true',
+                        help="Run an HTTP conversion service instead of "
+                             "converting input files")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="Address the service listens on")
+    parser.add_argument('--port', type=int, default=8000,
+                        help="Port the service listens on")
+    parser.add_argument('--timeout', type=float, default=30,
+                        help="Maximal number of seconds per request of the "
+                             "service")
+    args = parser.parse_args()
+    if not args.serve and not args.input_files:
+        parser.error('the following arguments are required: input_file')
+    if len(args.input_files) > 1 and args.output_dir is None and not args.watch:
+        parser.error('multiple inputs require --output_dir')
+    if args.watch and (args.staff == 'all' or args.output_dir is not None):
+        parser.error('--watch writes a single staff next to the inputs')
+    if args.streaming and args.backend != 'tree':
+        parser.error('--streaming requires --backend tree')
+    if args.streaming and args.staff == 'all':
+        parser.error('--streaming requires a single staff')
+    if args.incremental_dir is not None and (args.staff == 'all' or
+                                             args.output_dir is not None):
+        parser.error('--incremental_dir requires a single staff without --output_dir')
+    if args.decode_workers > 1 and (args.streaming or args.backend != 'tree'):
+        parser.error('--decode_workers requires --backend tree without '
+                     '--streaming')
+    return args
 
+def createReaders(input_file, staff, streaming=False, score_cache=None,
+                  backend='tree', decode_workers=1, data=None):
+    if staff == 'all':
+        reader = MusicXMLReader(input_file, streaming=streaming,
+                                score_cache=score_cache, backend=backend,
+                                decode_workers=decode_workers, data=data)
+        return reader.splitStaves()
+    return [MusicXMLReader(input_file, staff, streaming=streaming,
+                           score_cache=score_cache, backend=backend,
+                           decode_workers=decode_workers, data=data)]
 
-if __name__ == "__main__":
-    args = parseArguments()
+def writeFile(input_file, output, grammar, staff=1, ignore_key=False,
+              notes_per_line=0, streaming=False, score_cache=None,
+              backend='tree', render_workers=1, decode_workers=1, data=None):
+    """ write the text converter.py prints for input_file to a text stream
+
+    data, when given, holds the document to convert instead of input_file.
+    """
+    for reader in createReaders(input_file, staff, streaming, score_cache,
+                                backend, decode_workers, data):
+        writer = createWriter(grammar,
+                              ignore_key=ignore_key,
+                              notes_per_line=notes_per_line)
+        for piece in writer.iterGenerate(reader, render_workers):
+            output.write(piece)
+        output.write('\n')
+
+def convertFile(input_file, grammar, staff=1, ignore_key=False,
+                notes_per_line=0, streaming=False, score_cache=None,
+                backend='tree', render_workers=1, decode_workers=1, data=None):
+    """ return the text converter.py prints for input_file """
+    output = io.StringIO()
+    writeFile(input_file, output, grammar, staff, ignore_key, notes_per_line,
+              streaming, score_cache, backend, render_workers, decode_workers,
+              data)
+    return output.getvalue()
+
+def convert(data, grammar=None, output=None, **options):
+    """ convert a document held in memory, without touching the disk
+
+    data is the bytes of a MusicXML or compressed .mxl document, or a
+    binary file object to read them from; options are those of
+    convertFile(). The text is returned, or written to the text stream
+    output when given.
+    """
+    if hasattr(data, 'read'):
+        data = data.read()
+    data = bytes(data)
+    if grammar is None:
+        grammar = getGrammars()[0]
+    if output is None:
+        return convertFile(None, grammar, data=data, **options)
+    writeFile(None, output, grammar, data=data, **options)
+
+def getConvertOptions(args, score_cache=None):
+    options = dict(
+        grammar=args.grammar,
+        staff=args.staff,
+        ignore_key=args.ignore_key,
+        notes_per_line=args.notes_per_line,
+        streaming=args.streaming,
+        backend=args.backend,
+    )
+    if score_cache is not None:
+        options['score_cache'] = score_cache
+    return options
+
+
+def getCacheConfig(args):
+    if args.cache_dir is None:
+        return None
+    return (args.cache_dir, args.cache_size * 1024 * 1024)
+
+
+def run(args):
+    """ run the conversion described by the parsed arguments; return status """
+    if args.serve:
+        import server
+        server.serve(args.host, args.port, args.workers, args.timeout)
+        return 0
 
-    reader = MusicXMLReader(args.input_file, args.staff)
-    writer = createWriter(args.grammar,
-                          ignore_key=args.ignore_key,
-                          notes_per_line=args.notes_per_line)
+    score_cache = None
+    if args.score_cache_dir is not None:
+        from cache import ScoreCache
+        score_cache = ScoreCache(args.score_cache_dir,
+                                 args.cache_size * 1024 * 1024)
+        if args.clear_cache:
+            score_cache.clear()
 
+    if args.clear_cache and args.cache_dir is not None:
+        from cache import ConversionCache
+        ConversionCache(*getCacheConfig(args)).clear()
+
+    if args.output_dir is not None:
+        import batch
+        tasks = batch.createTasks(args.input_files, args.output_dir)
+        results = batch.runBatch(tasks, getConvertOptions(args, score_cache),
+                                 args.workers, getCacheConfig(args))
+        return 0 if batch.printSummary(results) else 1
+
+    state_cache = None
+    if args.incremental_dir is not None:
+        from cache import StateCache
+        state_cache = StateCache(args.incremental_dir,
+                                 args.cache_size * 1024 * 1024)
+        if args.clear_cache:
+            state_cache.clear()
+
+    if args.watch:
+        import watch
+        watcher = watch.Watcher(args.input_files, args.grammar, args.staff,
+                                args.ignore_key, args.notes_per_line,
+                                state_cache, log=sys.stderr)
+        watcher.run(args.watch_interval)
+        return 0
+
+    if state_cache is not None:
+        from incremental import IncrementalConverter
+        converter = IncrementalConverter(args.input_files[0], args.grammar,
+                                         args.staff, args.ignore_key,
+                                         args.notes_per_line, state_cache)
+        try:
+            sys.stdout.write(converter.convert())
+        except WriterError as e:
+            print(f'error: {str(e)}')
+        return 0
+
+    if args.cache_dir is not None:
+        from cache import ConversionCache
+        cache = ConversionCache(*getCacheConfig(args))
+        try:
+            sys.stdout.write(cache.convert(args.input_files[0],
+                                           **getConvertOptions(args, score_cache)))
+        except WriterError as e:
+            print(f'error: {str(e)}')
+        if args.cache_stats:
+            print(cache.getStats(), file=sys.stderr)
+        return 0
+
+    for reader in createReaders(args.input_files[0], args.staff, args.streaming,
+                                score_cache, args.backend, args.decode_workers):
+        writer = createWriter(args.grammar,
+                              ignore_key=args.ignore_key,
+                              notes_per_line=args.notes_per_line)
+        try:
+            for piece in writer.iterGenerate(reader, args.render_workers):
+                sys.stdout.write(piece)
+            sys.stdout.write('\n')
+        except WriterError as e:
+            print(f'error: {str(e)}')
+    if args.cache_stats and score_cache is not None:
+        print(score_cache.getStats(), file=sys.stderr)
+    return 0
+
+def runProfiled(args):
+    """ run with the profiling hooks enabled and print their statistics """
+    import profiling
+    profiler = profiling.enable()
+    if args.pstats:
+        import cProfile
+        cprofile = cProfile.Profile()
+        cprofile.enable()
     try:
-        print(writer.generate(reader))
-    except WriterError as e:
-        print(f'error: {str(e)}')
+        return run(args)
+    finally:
+        if args.pstats:
+            cprofile.disable()
+            cprofile.dump_stats(args.pstats)
+        profiling.disable()
+        print(profiler.report(), file=sys.stderr)
+
+def main():
+    args = parseArguments()
+    if args.profile or args.pstats:
+        return runProfiled(args)
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
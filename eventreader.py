@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+
+from lxml import etree
+
+import profiling
+from reader import (ACCIDENTAL_FLAGS, ALTER_FLAGS, Measure, MeasureBuilder,
+                    MusicXMLParseError, NoteRecord, NOTE_CHORD, NOTE_REST,
+                    NOTE_SLIDE, NOTE_SLIDE_START, NOTE_SLIDE_STOP,
+                    NOTE_TIE_START, NOTE_TIE_STOP, NOTE_TUPLET,
+                    NOTE_TUPLET_START, NOTE_TUPLET_STOP)
+
+FEED_SIZE = 64 * 1024  # bytes handed to the parser at a time
+
+class NoteState:
+    """ what decodeNote() tracks while walking a <note> element """
+
+    def __init__(self, attrib):
+        self.record = NoteRecord()
+        y = attrib.get('default-y')
+        if y is not None:
+            self.record.default_y = float(y)
+        self.flags = 0
+        self.alter = None
+        self.pitch_alter = None
+        self.accidental = None
+        self.has_staff = self.has_voice = False
+        self.actual_notes = self.normal_notes = None  # texts of one time-modification
+        self.has_actual = self.has_normal = False
+        self.has_tremolo = self.has_string = False  # in the current parent
+
+    def finish(self):
+        """ return the NoteRecord, as decodeNote() would """
+        record = self.record
+        flags = self.flags
+        if self.alter is not None:
+            flags |= ALTER_FLAGS.get(self.alter, 0)
+        else:
+            flags |= ACCIDENTAL_FLAGS.get(self.accidental, 0)
+        if not flags & NOTE_TUPLET:
+            flags &= ~(NOTE_TUPLET_START | NOTE_TUPLET_STOP)
+        record.flags = flags
+        return record
+
+class ScoreTarget:
+    """ lxml parser target building the reader's measures from events
+
+    The element tree is never built: the header fields, part list and
+    measures are decoded from start/end/data events, following the same
+    rules as the tree reader (decodeNote, Measure and the header XPaths).
+    """
+
+    def __init__(self, options):
+        self._options = options
+        self._path = []
+        self._text = []
+        self.data = self._text.append  # called for every text chunk
+        self._text_open = False  # whether self._text is the innermost text
+        self._closed_texts = {}  # depth -> text ended by a child or comment
+        self._in_header = False  # in a <work-title> or <creator> element
+        self._header_text = None  # its first text node, like XPath text()
+        self.work_title = None
+        self.composer = None
+        self.parts = []
+        self.measures = {}  # part id -> list of Measure
+        self._part = None  # measures of the part being read, or None
+        self._builder = None
+        self._note = None
+        self._direction = None  # ([sound attributes], [words texts])
+        self._barline = None  # [location, has bar-style, text, has repeat]
+        self._attributes = None  # fields of the first <attributes> element
+        self._in_composer = False
+
+    def start(self, tag, attrib):
+        path = self._path
+        if self._in_header:
+            self._readHeaderText()
+        if self._text_open:  # the text of the parent ends here
+            self._closed_texts[len(path)] = self._getText()
+        path.append(tag)
+        self._text.clear()
+        self._text_open = True
+        depth = len(path)
+        if depth > 3 and self._builder is not None:  # most events
+            self._startInMeasure(depth, tag, attrib)
+        elif depth == 1:
+            if tag != 'score-partwise':
+                raise MusicXMLParseError(f'unsupported root element: {tag}')
+        elif depth == 2:
+            if tag == 'part':
+                part_id = attrib.get('id')
+                if part_id in self.parts:
+                    self._part = self.measures.setdefault(part_id, [])
+        elif depth == 3:
+            if tag == 'measure':
+                if path[1] == 'part' and self._part is not None:
+                    self._builder = MeasureBuilder(attrib.get('number'))
+            elif tag == 'score-part':
+                if path[1] == 'part-list':
+                    self.parts.append(attrib.get('id'))
+            elif tag == 'creator':
+                self._in_composer = (path[1] == 'identification' and
+                                     attrib.get('type') == 'composer')
+                self._in_header = True
+            elif tag == 'work-title':
+                self._in_header = True
+
+    def _startInMeasure(self, depth, tag, attrib):
+        path = self._path
+        if depth == 4:
+            if tag == 'note':
+                self._note = NoteState(attrib)
+            elif tag == 'direction':
+                self._direction = ([], [])
+            elif tag == 'barline':
+                self._barline = [attrib.get('location'), False, None, False]
+            elif tag == 'attributes' and self._builder.attributes is None:
+                self._attributes = {}
+            return
+
+        context = path[3]
+        if context == 'note':
+            note = self._note
+            if depth == 5:
+                if tag == 'rest':
+                    note.flags |= NOTE_REST
+                elif tag == 'chord':
+                    note.flags |= NOTE_CHORD
+                elif tag == 'tie':
+                    kind = attrib.get('type')
+                    if kind == 'start':
+                        note.flags |= NOTE_TIE_START
+                    elif kind == 'stop':
+                        note.flags |= NOTE_TIE_STOP
+                elif tag == 'time-modification':
+                    note.flags |= NOTE_TUPLET
+                    note.has_actual = note.has_normal = False
+                elif tag == 'pitch':
+                    note.pitch_alter = None
+            elif path[4] == 'notations':
+                if depth == 6:
+                    if tag == 'tuplet':
+                        kind = attrib.get('type')
+                        if kind == 'start':
+                            note.flags |= NOTE_TUPLET_START
+                        elif kind == 'stop':
+                            note.flags |= NOTE_TUPLET_STOP
+                    elif tag == 'slide':
+                        note.flags |= NOTE_SLIDE
+                        kind = attrib.get('type')
+                        if kind == 'start':
+                            note.flags |= NOTE_SLIDE_START
+                        elif kind == 'stop':
+                            note.flags |= NOTE_SLIDE_STOP
+                        y = attrib.get('default-y')
+                        if y is not None and note.record.slide_default_y is None:
+                            note.record.slide_default_y = float(y)
+                    elif tag == 'ornaments':
+                        note.has_tremolo = False
+                    elif tag == 'technical':
+                        note.has_string = False
+        elif context == 'direction':
+            if depth == 5 and tag == 'sound':
+                self._direction[0].append(attrib)
+        elif context == 'barline':
+            if depth == 5 and tag == 'repeat':
+                self._barline[3] = True
+
+    def _getText(self):
+        """ return the text of the element being closed, like elem.text,
+        which stops at its first child or comment """
+        if self._text_open:
+            return ''.join(self._text) if self._text else None
+        return self._closed_texts.get(len(self._path))
+
+    def _readHeaderText(self):
+        """ keep the text read so far if it is the first text node of the
+        header element, which the tree reader selects with XPath text() """
+        if len(self._path) == 3 and self._header_text is None and self._text:
+            self._header_text = ''.join(self._text)
+
+    def comment(self, text):
+        if self._in_header:
+            self._readHeaderText()
+        if self._text_open:
+            self._closed_texts[len(self._path)] = self._getText()
+            self._text_open = False
+        self._text.clear()  # text after the comment is another text node
+
+    def pi(self, target, data):
+        self.comment(data)
+
+    def end(self, tag):
+        path = self._path
+        depth = len(path)
+        if depth > 3 and self._builder is not None:  # most events
+            self._endInMeasure(depth, tag)
+        elif depth == 3:
+            if tag == 'measure' and self._builder is not None:
+                part = self._part
+                prev_measure = part[-1] if part else None
+                with profiling.stage('measures'):
+                    part.append(Measure.fromBuilder(self._builder, prev_measure,
+                                                    self._options))
+                self._builder = None
+            elif tag == 'work-title' or tag == 'creator':
+                self._readHeaderText()
+                text = self._header_text
+                if tag == 'creator':
+                    if self._in_composer and self.composer is None and text:
+                        self.composer = text
+                    self._in_composer = False
+                elif path[1] == 'work' and self.work_title is None and text:
+                    self.work_title = text
+                self._in_header = False
+                self._header_text = None
+        elif depth == 2 and tag == 'part':
+            self._part = None
+        self._text_open = False
+        self._text.clear()  # the tail text is another text node
+        path.pop()
+
+    def _endInMeasure(self, depth, tag):
+        path = self._path
+        if depth == 4:
+            builder = self._builder
+            if tag == 'note':
+                builder.addNote(self._note.finish())
+                self._note = None
+            elif tag == 'direction':
+                builder.addDirection(*self._direction)
+                self._direction = None
+            elif tag == 'barline':
+                builder.addBarline(*self._barline)
+                self._barline = None
+            elif tag == 'attributes' and self._attributes is not None:
+                builder.attributes = self._attributes
+                self._attributes = None
+            return
+
+        context = path[3]
+        if context == 'note':
+            self._endInNote(depth, tag)
+        elif context == 'direction':
+            if depth == 6 and tag == 'words' and path[4] == 'direction-type':
+                self._direction[1].append(self._getText())
+        elif context == 'barline':
+            barline = self._barline
+            if depth == 5 and tag == 'bar-style' and not barline[1]:
+                barline[1] = True
+                barline[2] = self._getText()
+        elif context == 'attributes' and self._attributes is not None:
+            fields = self._attributes
+            if depth == 5:
+                if tag == 'divisions' or tag == 'staves':
+                    fields.setdefault(tag, self._getText())
+            elif depth == 6:
+                parent = path[4]
+                if parent == 'key' and tag == 'fifths':
+                    fields.setdefault('fifths', self._getText())
+                elif parent == 'time' and (tag == 'beats' or tag == 'beat-type'):
+                    fields.setdefault(tag, self._getText())
+
+    def _endInNote(self, depth, tag):
+        note = self._note
+        record = note.record
+        if depth == 5:
+            if tag == 'duration':
+                if record.duration is None:
+                    record.duration = int(self._getText())
+            elif tag == 'pitch':
+                note.alter = note.pitch_alter
+            elif tag == 'time-modification':
+                if (record.actual_notes is None and note.has_actual and
+                        note.has_normal):
+                    record.actual_notes = int(note.actual_notes)
+                    record.normal_notes = int(note.normal_notes)
+            elif tag == 'accidental':
+                if note.accidental is None:
+                    note.accidental = self._getText()
+            elif tag == 'staff':
+                if not note.has_staff:
+                    record.staff = int(self._getText())
+                    note.has_staff = True
+            elif tag == 'voice':
+                if not note.has_voice:
+                    record.voice = int(self._getText())
+                    note.has_voice = True
+            return
+
+        parent = self._path[4]
+        if depth == 6:
+            if parent == 'pitch':
+                if tag == 'step':
+                    record.step = self._getText()
+                elif tag == 'octave':
+                    record.octave = int(self._getText())
+                elif tag == 'alter' and note.pitch_alter is None:
+                    note.pitch_alter = self._getText()
+            elif parent == 'time-modification':
+                if tag == 'actual-notes' and not note.has_actual:
+                    note.has_actual = True
+                    note.actual_notes = self._getText()
+                elif tag == 'normal-notes' and not note.has_normal:
+                    note.has_normal = True
+                    note.normal_notes = self._getText()
+        elif depth == 7 and parent == 'notations':
+            group = self._path[5]
+            if group == 'ornaments' and tag == 'tremolo':
+                if not note.has_tremolo:
+                    note.has_tremolo = True
+                    if not record.tremolo:
+                        record.tremolo = int(self._getText())
+            elif group == 'technical' and tag == 'string':
+                if not note.has_string:
+                    note.has_string = True
+                    if record.string == 1000:
+                        record.string = int(self._getText())
+
+    def close(self):
+        return self
+
+def parseScoreEvents(source, options):
+    """ decode a binary file object with a ScoreTarget; return the target """
+    target = ScoreTarget(options)
+    parser = etree.XMLParser(target=target)
+    for chunk in iter(lambda: source.read(FEED_SIZE), b''):
+        parser.feed(chunk)
+    return parser.close()
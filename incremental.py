@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+import hashlib
+import re
+
+from lxml import etree
+
+import profiling
+from cache import computeStateKey
+from converter import convertFile
+from reader import (Measure, MusicXMLReader, ReaderOptions, openMusicXML,
+                    scanMeasure)
+from writer import createWriter, iterLinePlan
+
+TOKEN_PATTERN = re.compile(
+    rb'<(part|measure)(?=[\s/>])(?:[^>"\']|"[^"]*"|\'[^\']*\')*>'
+    rb'|</(part|measure)\s*>|<!--|<!\[CDATA\[|<\?')
+SKIPPED_TOKENS = {b'<!--': b'-->', b'<![CDATA[': b']]>', b'<?': b'?>'}
+PART_ID_PATTERN = re.compile(rb'\sid\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+ENCODING_PATTERN = re.compile(rb'<\?xml[^>]*encoding\s*=\s*["\']([^"\']*)')
+
+def scanMeasureSpans(data):
+    """ return {part id: [(start, stop) of every <measure> element]}
+
+    The spans index the document bytes, so that measures can be told apart
+    without parsing them. None is returned for documents the scan does not
+    handle: other encodings than UTF-8, or entity declarations.
+    """
+    if b'<!ENTITY' in data or data.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return None
+    match = ENCODING_PATTERN.match(data)
+    if match and match.group(1).lower() not in (b'utf-8', b'utf8'):
+        return None
+
+    spans = {}
+    part = None  # spans of the part being scanned
+    measure_start = None
+    pos = 0
+    while True:
+        match = TOKEN_PATTERN.search(data, pos)
+        if match is None:
+            break
+        pos = match.end()
+        token = match.group()
+        end_token = SKIPPED_TOKENS.get(token)
+        if end_token is not None:
+            pos = data.find(end_token, pos)
+            if pos < 0:
+                return None
+            continue
+        if match.group(1) == b'part':
+            if part is not None:
+                return None
+            found = PART_ID_PATTERN.search(token)
+            part_id = found.group(1) or found.group(2) if found else b''
+            if b'&' in part_id:
+                return None
+            part = spans.setdefault(part_id.decode('utf-8'), [])
+            if token.endswith(b'/>'):
+                part = None
+        elif match.group(1) == b'measure':
+            if part is None or measure_start is not None:
+                return None
+            if token.endswith(b'/>'):
+                part.append((match.start(), pos))
+            else:
+                measure_start = match.start()
+        elif match.group(2) == b'measure':
+            if measure_start is None:
+                return None
+            part.append((measure_start, pos))
+            measure_start = None
+        else:
+            part = None
+    return spans
+
+class ConversionState:
+    """ what a conversion keeps for the next one of the same input """
+
+    def __init__(self, source, output, outlines, fragments, lines):
+        self.source = source  # document digest
+        self.output = output
+        self.outlines = outlines  # measure digest -> MeasureBuilder without notes
+        self.fragments = fragments  # fingerprint -> (body, number of notes)
+        self.lines = lines  # (fingerprints, previous fingerprint) -> text
+
+class IncrementalConverter:
+    """ converts an input again and again, rendering only changed measures
+
+    A measure is fingerprinted by the digest of its bytes with the values
+    of the attributes it inherits. The rendered body of every fingerprint
+    and the text of every line are kept from one conversion to the next,
+    so that an edit only parses and renders the measures it touched and
+    the lines around them. Documents scanMeasureSpans() does not handle are
+    converted in full every time. The state is also stored in state_cache,
+    a cache.StateCache, when given, for the next process.
+    """
+
+    def __init__(self, input_file, grammar, staff=1, ignore_key=False,
+                 notes_per_line=0, state_cache=None):
+        self._input_file = input_file
+        self._grammar = grammar
+        self._staff = staff
+        self._ignore_key = ignore_key
+        self._notes_per_line = notes_per_line
+        self._state_cache = state_cache
+        self._writer = createWriter(grammar,
+                                    ignore_key=ignore_key,
+                                    notes_per_line=notes_per_line)
+        self._state_key = None
+        self._state = None
+        if state_cache is not None:
+            self._state_key = computeStateKey(input_file, grammar, staff,
+                                              ignore_key, notes_per_line)
+            self._state = state_cache.get(self._state_key)
+        self.rendered_measures = 0  # by the last convert()
+
+    def convert(self):
+        """ return the text convertFile() returns for the input """
+        with openMusicXML(self._input_file) as f:
+            data = f.read()
+        source = hashlib.sha256(data).digest()
+        self.rendered_measures = 0
+        if self._state is not None and self._state.source == source:
+            return self._state.output
+
+        state = ConversionState(source, None, {}, {}, {})
+        spans = scanMeasureSpans(data)
+        if spans is None:
+            state.output = convertFile(self._input_file, self._grammar,
+                                       self._staff, self._ignore_key,
+                                       self._notes_per_line)
+        else:
+            state.output = self._convertMeasures(data, spans, state)
+        self._state = state
+        if self._state_cache is not None:
+            self._state_cache.put(self._state_key, state)
+        return state.output
+
+    def _convertMeasures(self, data, spans, state):
+        old_state = self._state
+        if old_state is None:
+            old_state = ConversionState(None, None, {}, {}, {})
+        reader = MusicXMLReader(self._input_file, self._staff, streaming=True)
+        writer = self._writer  # its tables stay warm between conversions
+        parts = reader.getPartIdList()
+        part_outlines = []  # measures without notes, for the barlines
+        part_fingerprints = []
+        for part in parts:
+            outlines, fingerprints = self._renderPart(
+                writer, data, spans.get(part, []), old_state, state)
+            part_outlines.append(outlines)
+            part_fingerprints.append(fingerprints)
+
+        num_measures_per_line = writer.computeNumMeasuresPerLineFromCounts(
+            [[state.fragments[fingerprint][1] for fingerprint in fingerprints]
+             for fingerprints in part_fingerprints])
+        body = []
+        for line in iterLinePlan([len(outlines) for outlines in part_outlines],
+                                 num_measures_per_line):
+            if line is None:
+                body.append(writer.toLine(None, len(parts), None))
+                continue
+            part_index, start, stop, prev = line
+            prev_measure = prev_fingerprint = None
+            if prev is not None:
+                prev_measure = part_outlines[prev[0]][prev[1]]
+                prev_fingerprint = part_fingerprints[prev[0]][prev[1]]
+            key = (tuple(part_fingerprints[part_index][start:stop]),
+                   prev_fingerprint)
+            text = old_state.lines.get(key)
+            if text is None:
+                with profiling.stage('render'):
+                    text = writer.generateMeasures(
+                        part_outlines[part_index][start:stop], prev_measure,
+                        [state.fragments[fingerprint][0] for fingerprint in key[0]])
+            state.lines[key] = text
+            body.append(writer.toLine(part_index, len(parts), text))
+        return writer.generateHeader(reader) + '\n' + '\n'.join(body) + '\n'
+
+    def _renderPart(self, writer, data, spans, old_state, state):
+        """ return the outlines and fingerprints of the measures of a part,
+        adding what they need to state """
+        options = ReaderOptions()
+        options.staff = max(self._staff, 1)
+        outlines = []
+        fingerprints = []
+        prev_outline = None
+        for start, stop in spans:
+            text = data[start:stop]
+            digest = hashlib.sha1(text).digest()
+            elem = None
+            builder = state.outlines.get(digest) or old_state.outlines.get(digest)
+            if builder is None:
+                elem = etree.fromstring(text)
+                builder = scanMeasure(elem, decode_notes=False)
+            state.outlines[digest] = builder
+            outline = Measure.fromBuilder(builder, prev_outline, options)
+
+            fingerprint = (digest, outline.getAttributes().getValues())
+            if fingerprint not in state.fragments:
+                fragment = old_state.fragments.get(fingerprint)
+                if fragment is None:
+                    if elem is None:
+                        elem = etree.fromstring(text)
+                    measure = Measure.fromBuilder(scanMeasure(elem),
+                                                  prev_outline, options)
+                    with profiling.stage('render'):
+                        fragment = (writer.generateMeasure(measure),
+                                    len(measure.getNotes()))
+                    self.rendered_measures += 1
+                state.fragments[fingerprint] = fragment
+            outlines.append(outline)
+            fingerprints.append(fingerprint)
+            prev_outline = outline
+        return outlines, fingerprints
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import time
+
+class Profiler:
+    """ accumulates inclusive stage timings and event counters
+
+    The clock can be replaced to plug in another timer, and subclasses may
+    override count() and addTime() to forward the events elsewhere.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.timers = {}  # name -> [total seconds, number of calls]
+        self.counters = {}
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def addTime(self, name, seconds):
+        timer = self.timers.setdefault(name, [0.0, 0])
+        timer[0] += seconds
+        timer[1] += 1
+
+    def stage(self, name):
+        return StageTimer(self, name)
+
+    def report(self):
+        lines = [f'{"stage":<16}{"calls":>10}{"total ms":>12}']
+        for name, (seconds, calls) in self.timers.items():
+            lines.append(f'{name:<16}{calls:>10}{seconds * 1000:>12.3f}')
+        lines.append('')
+        lines.append(f'{"counter":<16}{"value":>10}')
+        for name, value in self.counters.items():
+            lines.append(f'{name:<16}{value:>10}')
+        return '\n'.join(lines)
+
+class StageTimer:
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._start = self._profiler.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._profiler.addTime(self._name, self._profiler.clock() - self._start)
+        return False
+
+class NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_null_stage = NullStage()
+_profiler = None
+
+def enable(profiler=None):
+    """ install a profiler for the hooks below and return it """
+    global _profiler
+    _profiler = profiler if profiler is not None else Profiler()
+    return _profiler
+
+def disable():
+    global _profiler
+    _profiler = None
+
+def isEnabled():
+    return _profiler is not None
+
+def count(name, amount=1):
+    if _profiler is not None:
+        _profiler.count(name, amount)
+
+def stage(name):
+    """ return a context manager timing a stage, or a shared no-op """
+    if _profiler is None:
+        return _null_stage
+    return _profiler.stage(name)
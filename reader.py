@@ -1,7 +1,14 @@
 #!/usr/bin/env python
 
+import io
+import weakref
+
 from lxml import etree
-import zipfile
+
+import profiling
+
+READER_VERSION = '1'  # bump whenever the decoded measures or notes change
+READER_BACKENDS = ('tree', 'events')
 
 MUSICXML_FIFTHS_TABLE = {
     0: 'C',
@@ -14,64 +21,130 @@ MUSICXML_FIFTHS_TABLE = {
 class MusicXMLParseError(Exception):
     pass
 
+def scanAttributes(elem):
+    """ return the fields of an <attributes> element as a dict of texts
+
+    Keys are 'fifths', 'beats', 'beat-type', 'divisions' and 'staves';
+    a key is missing when the document does not give that field.
+    """
+    fields = {}
+    for child in elem:
+        tag = child.tag
+        if tag == 'divisions' or tag == 'staves':
+            fields.setdefault(tag, child.text)
+        elif tag == 'key' and 'fifths' not in fields:
+            fifths = child.find('fifths')
+            if fifths is not None:
+                fields['fifths'] = fifths.text
+        elif tag == 'time':
+            for name in ('beats', 'beat-type'):
+                if name not in fields:
+                    value = child.find(name)
+                    if value is not None:
+                        fields[name] = value.text
+    return fields
+
+def resolveAttributes(fields, prev_attributes):
+    """ return (keysig, time, divisions, staves) from scanAttributes() fields """
+    if 'fifths' in fields:
+        keysig = MUSICXML_FIFTHS_TABLE[int(fields['fifths'])]
+    elif prev_attributes:
+        keysig = prev_attributes.getKeySignature()
+    else:
+        raise MusicXMLParseError("fifths not found in attribute")
+
+    if 'beats' in fields and 'beat-type' in fields:
+        time = (int(fields['beats']), int(fields['beat-type']))
+    elif prev_attributes:
+        time = prev_attributes.getTime()
+    else:
+        raise MusicXMLParseError("time not found in attribute")
+
+    if 'divisions' in fields:
+        divisions = int(fields['divisions'])
+    elif prev_attributes:
+        divisions = prev_attributes.getDivisions()
+    else:
+        raise MusicXMLParseError("divisions not found in attribute")
+
+    if 'staves' in fields:
+        staves = int(fields['staves'])
+    elif prev_attributes:
+        staves = prev_attributes.getStaves()
+    else:
+        staves = 1  # default value
+
+    return keysig, time, divisions, staves
+
+def decodeAttributes(elem, prev_attributes):
+    """ return (keysig, time, divisions, staves) of an <attributes> element """
+    return resolveAttributes(scanAttributes(elem), prev_attributes)
+
 class Attributes:
+    """ immutable attributes state
 
-    def __init__(self, elem, prev_attributes=None):
+    Instances are interned by value: every measure with the same key, time,
+    divisions and staves shares one object, so they can be compared with
+    `is`. The table only holds weak references, so that long-running
+    processes do not keep the attributes of every score they read.
+    """
+
+    __slots__ = ('_keysig', '_time', '_divisions', '_staves', '__weakref__')
+
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, elem, prev_attributes=None):
         if elem is None:
             raise MusicXMLParseError("attribute not found")
         assert(elem.tag == 'attributes')
-        self._elem = elem
-        self._cache = {
-            'keysig': self._getKeySignature(prev_attributes),
-            'time' : self._getTime(prev_attributes),
-            'divisions': self._getDivisions(prev_attributes),
-            'staves': self._getStaves(prev_attributes),
-        }
-
-    def _getDivisions(self, prev_attributes):
-        divisions = self._elem.find('divisions')
-        if divisions is None:
-            if prev_attributes:
-                return prev_attributes.getDivisions()
-            raise MusicXMLParseError("divisions not found in attribute")
-        return int(divisions.text)
-
-    def _getKeySignature(self, prev_attributes):
-        fifths = self._elem.find('key/fifths')
-        if fifths is None:
-            if prev_attributes:
-                return prev_attributes.getKeySignature()
-            raise MusicXMLParseError("fifths not found in attribute")
-        return MUSICXML_FIFTHS_TABLE[int(fifths.text)]
-
-    def _getTime(self, prev_attributes):
-        beats = self._elem.find('time/beats')
-        beat_type = self._elem.find('time/beat-type')
-        if beats is None or beat_type is None:
-            if prev_attributes:
-                return prev_attributes.getTime()
-            raise MusicXMLParseError("time not found in attribute")
-        return int(beats.text), int(beat_type.text)
- 
-    def _getStaves(self, prev_attributes):
-        staves = self._elem.find('staves')
-        if staves is None:
-            if prev_attributes:
-                return prev_attributes.getStaves()
-            return 1  # default value
-        return int(staves.text)
+        return cls.fromValues(*decodeAttributes(elem, prev_attributes))
+
+    def __init__(self, elem, prev_attributes=None):
+        pass  # initialized by fromValues
+
+    @classmethod
+    def fromValues(cls, keysig, time, divisions, staves):
+        key = (keysig, tuple(time), divisions, staves)
+        attributes = cls._interned.get(key)
+        if attributes is None:
+            attributes = object.__new__(cls)
+            for name, value in zip(cls.__slots__[:-1], key):
+                object.__setattr__(attributes, name, value)
+            attributes = cls._interned.setdefault(key, attributes)
+        return attributes
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Attributes is immutable')
+
+    def __reduce__(self):
+        return (Attributes.fromValues, self.getValues())
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def getValues(self):
+        return (self._keysig, self._time, self._divisions, self._staves)
 
     def getDivisions(self):
-        return self._cache['divisions']
+        return self._divisions
 
     def getKeySignature(self):
-        return self._cache['keysig']
+        return self._keysig
 
     def getTime(self):
-        return self._cache['time']
+        return self._time
 
     def getStaves(self):
-        return self._cache['staves']
+        return self._staves
+
+PART_MEASURES_XPATH = etree.XPath('part[@id=$part]/measure')
+SCORE_PARTS_XPATH = etree.XPath('part-list/score-part')
+WORK_TITLE_XPATH = etree.XPath('work/work-title/text()')
+COMPOSER_XPATH = etree.XPath("identification/creator[@type='composer']/text()")
+ROOTFILE_XPATH = etree.XPath('rootfiles/rootfile')
 
 ACCIDENTAL_TABLE = {
     'C':  ('#', []),
@@ -101,118 +174,290 @@ class Base:
         return float(self._get_text(path, str(default)))
 
     def _get_bool(self, path):
+        profiling.count('xpath')
         return bool(self._elem.xpath(path))
 
     def _get_text(self, path, default=None):
         if not path.split('/')[-1].startswith('@'):
             path += '/text()'
+        profiling.count('xpath')
         results = self._elem.xpath(path)
         if results:
             return results[0]
         return default
 
-class Note(Base):
+NOTE_REST = 1 << 0
+NOTE_CHORD = 1 << 1
+NOTE_TIE_START = 1 << 2
+NOTE_TIE_STOP = 1 << 3
+NOTE_TUPLET = 1 << 4
+NOTE_TUPLET_START = 1 << 5
+NOTE_TUPLET_STOP = 1 << 6
+NOTE_SLIDE = 1 << 7
+NOTE_SLIDE_START = 1 << 8
+NOTE_SLIDE_STOP = 1 << 9
+NOTE_SHARP = 1 << 10
+NOTE_FLAT = 1 << 11
+NOTE_NATURAL = 1 << 12
+
+ACCIDENTAL_FLAGS = {
+    'sharp': NOTE_SHARP,
+    'flat': NOTE_FLAT,
+    'natural': NOTE_NATURAL,
+}
+
+ALTER_FLAGS = {
+    '1': NOTE_SHARP,
+    '-1': NOTE_FLAT,
+    '0': NOTE_NATURAL,
+}
+
+class NoteRecord:
+    """ everything the converter reads from a <note> element """
+
+    __slots__ = ('step', 'octave', 'duration', 'flags', 'actual_notes',
+                 'normal_notes', 'tremolo', 'staff', 'voice', 'string',
+                 'default_y', 'slide_default_y')
+
+    def __init__(self):
+        self.step = None
+        self.octave = None
+        self.duration = None
+        self.flags = 0
+        self.actual_notes = None
+        self.normal_notes = None
+        self.tremolo = 0
+        self.staff = 1
+        self.voice = 1
+        self.string = 1000
+        self.default_y = 0.0
+        self.slide_default_y = None
+
+    @classmethod
+    def fromValues(cls, *values):
+        record = cls.__new__(cls)
+        (record.step, record.octave, record.duration, record.flags,
+         record.actual_notes, record.normal_notes, record.tremolo, record.staff,
+         record.voice, record.string, record.default_y,
+         record.slide_default_y) = values
+        return record
+
+    def __reduce__(self):  # a plain tuple pickles several times faster
+        return (NoteRecord.fromValues, self.getValues())
+
+    def getValues(self):
+        return (self.step, self.octave, self.duration, self.flags,
+                self.actual_notes, self.normal_notes, self.tremolo, self.staff,
+                self.voice, self.string, self.default_y, self.slide_default_y)
+
+def _decodePitch(elem, record):
+    alter = None
+    for child in elem:
+        tag = child.tag
+        if tag == 'step':
+            record.step = child.text
+        elif tag == 'octave':
+            record.octave = int(child.text)
+        elif tag == 'alter' and alter is None:
+            alter = child.text
+    return alter
+
+def _decodeNotations(elem, record):
+    flags = 0
+    for child in elem:
+        tag = child.tag
+        if tag == 'tuplet':
+            kind = child.get('type')
+            if kind == 'start':
+                flags |= NOTE_TUPLET_START
+            elif kind == 'stop':
+                flags |= NOTE_TUPLET_STOP
+        elif tag == 'slide':
+            flags |= NOTE_SLIDE
+            kind = child.get('type')
+            if kind == 'start':
+                flags |= NOTE_SLIDE_START
+            elif kind == 'stop':
+                flags |= NOTE_SLIDE_STOP
+            y = child.get('default-y')
+            if y is not None and record.slide_default_y is None:
+                record.slide_default_y = float(y)
+        elif tag == 'ornaments':
+            tremolo = child.find('tremolo')
+            if tremolo is not None and not record.tremolo:
+                record.tremolo = int(tremolo.text)
+        elif tag == 'technical':
+            string = child.find('string')
+            if string is not None and record.string == 1000:
+                record.string = int(string.text)
+    return flags
+
+def decodeNote(elem):
+    """ decode a <note> element into a NoteRecord in a single child walk """
+    record = NoteRecord()
+    y = elem.get('default-y')
+    if y is not None:
+        record.default_y = float(y)
+
+    flags = 0
+    alter = None
+    accidental = None
+    has_staff = has_voice = False
+    for child in elem:
+        tag = child.tag
+        if tag == 'pitch':
+            alter = _decodePitch(child, record)
+        elif tag == 'rest':
+            flags |= NOTE_REST
+        elif tag == 'chord':
+            flags |= NOTE_CHORD
+        elif tag == 'duration' and record.duration is None:
+            record.duration = int(child.text)
+        elif tag == 'tie':
+            kind = child.get('type')
+            if kind == 'start':
+                flags |= NOTE_TIE_START
+            elif kind == 'stop':
+                flags |= NOTE_TIE_STOP
+        elif tag == 'time-modification':
+            flags |= NOTE_TUPLET
+            if record.actual_notes is None:
+                actual = child.find('actual-notes')
+                normal = child.find('normal-notes')
+                if actual is not None and normal is not None:
+                    record.actual_notes = int(actual.text)
+                    record.normal_notes = int(normal.text)
+        elif tag == 'notations':
+            flags |= _decodeNotations(child, record)
+        elif tag == 'accidental' and accidental is None:
+            accidental = child.text
+        elif tag == 'staff' and not has_staff:
+            record.staff = int(child.text)
+            has_staff = True
+        elif tag == 'voice' and not has_voice:
+            record.voice = int(child.text)
+            has_voice = True
+
+    if alter is not None:
+        flags |= ALTER_FLAGS.get(alter, 0)
+    else:
+        flags |= ACCIDENTAL_FLAGS.get(accidental, 0)
+    if not flags & NOTE_TUPLET:
+        flags &= ~(NOTE_TUPLET_START | NOTE_TUPLET_STOP)
+    record.flags = flags
+    return record
+
+class Note:
+
+    __slots__ = ('_record', '_attributes')
 
     def __init__(self, elem, attributes):
         assert(elem.tag == 'note')
-        Base.__init__(self, elem)
+        self._record = decodeNote(elem)
         self._attributes = attributes
 
+    @classmethod
+    def fromRecord(cls, record, attributes):
+        note = cls.__new__(cls)
+        note._record = record
+        note._attributes = attributes
+        return note
+
+    def __reduce__(self):
+        return (Note.fromRecord, (self._record, self._attributes))
+
+    def getRecord(self):
+        return self._record
+
     def isRest(self):
-        return self._get_bool('rest')
+        return bool(self._record.flags & NOTE_REST)
 
     def isTieStart(self):
-        return self._get_bool("tie[@type='start']")
+        return bool(self._record.flags & NOTE_TIE_START)
 
     def isTieStop(self):
-        return self._get_bool("tie[@type='stop']")
+        return bool(self._record.flags & NOTE_TIE_STOP)
 
     def isTuplet(self):
-        return self._get_bool('time-modification')
+        return bool(self._record.flags & NOTE_TUPLET)
 
     def isTupletStart(self):
-        return self.isTuplet() and self._get_bool("notations/tuplet[@type='start']")
+        return bool(self._record.flags & NOTE_TUPLET_START)
 
     def isTupletStop(self):
-        return self.isTuplet() and self._get_bool("notations/tuplet[@type='stop']")
+        return bool(self._record.flags & NOTE_TUPLET_STOP)
 
     def isSlide(self):
-        return self._get_bool('notations/slide')
+        return bool(self._record.flags & NOTE_SLIDE)
 
     def isSlideStart(self):
-        return self.isSlide() and self._get_bool("notations/slide[@type='start']")
+        return bool(self._record.flags & NOTE_SLIDE_START)
 
     def isSlideStop(self):
-        return self.isSlide() and self._get_bool("notations/slide[@type='stop']")
+        return bool(self._record.flags & NOTE_SLIDE_STOP)
 
     def isSlideUp(self):
-        y = self._get_float('notations/slide/@default-y', default=0)
-        y0 = self._get_float('@default-y', default=0)
-        return y < y0
+        y = self._record.slide_default_y
+        if y is None:
+            y = 0.0
+        return y < self._record.default_y
 
     def isChord(self):
-        return self._get_bool('chord')
+        return bool(self._record.flags & NOTE_CHORD)
 
     def getDisplayedDuration(self):
         if not self.isTuplet():
             return self.getDuration()
-        actual_notes = self._get_int("time-modification/actual-notes")
-        normal_notes = self._get_int("time-modification/normal-notes")
+        record = self._record
+        if record.actual_notes is None:
+            raise MusicXMLParseError("tuplet ratio not found in time-modification")
         (duration, divisions) = self.getDuration()
-        return (duration * actual_notes // normal_notes, divisions)
+        return (duration * record.actual_notes // record.normal_notes, divisions)
 
     def getDuration(self):
         """ return a tuple (note divisions, divisions per quarternote) """
-        return (self._get_int('duration'), self._attributes.getDivisions())
+        if self._record.duration is None:
+            raise MusicXMLParseError("this note does not have duration")
+        return (self._record.duration, self._attributes.getDivisions())
 
     def getPitch(self):
         """ return a tuple (note_name, octave) """
-        step = self._elem.find('pitch/step')
-        octave = self._elem.find('pitch/octave')
-        if step is None or octave is None:
+        record = self._record
+        if record.step is None or record.octave is None:
             raise MusicXMLParseError("this note does not have pitch")
 
-        note_name = step.text
-        octave = int(octave.text)
-
-        alter = self._get_text('pitch/alter')
-        if alter is not None:
-            notated_sharp = alter == '1'
-            notated_flat = alter == '-1'
-            notated_natural = alter == '0'
-        else:
-            accidental = self._get_text('accidental')
-            notated_sharp = accidental == 'sharp'
-            notated_flat = accidental == 'flat'
-            notated_natural = accidental == 'natural'
+        note_name = record.step
+        flags = record.flags
 
         key = self._attributes.getKeySignature()
         key_accidental_char, key_accidental_list = ACCIDENTAL_TABLE[key]
-        if not notated_natural and note_name in key_accidental_list:
+        if not flags & NOTE_NATURAL and note_name in key_accidental_list:
             note_name += key_accidental_char
-        elif notated_sharp:
+        elif flags & NOTE_SHARP:
             note_name += '#'
-        elif notated_flat:
+        elif flags & NOTE_FLAT:
             note_name += 'b'
 
-        return (note_name, octave)
+        return (note_name, record.octave)
 
     def getAttributes(self):
         return self._attributes
 
     def getStaff(self):
-        return self._get_int('staff', default=1)
+        return self._record.staff
 
     def getVoice(self):
-        return self._get_int('voice', default=1)
+        return self._record.voice
 
     def getTremolo(self):
-        return self._get_int('notations/ornaments/tremolo', default=0)
+        return self._record.tremolo
+
+    def getString(self):
+        return self._record.string
 
 def chooseChordTonic(chord):
     # Note: only support tablature notation for now.
-    return min(chord, key=lambda note:
-        note._get_int('notations/technical/string', default=1000))
+    return min(chord, key=lambda note: note.getString())
 
 class ReaderOptions:
 
@@ -220,7 +465,113 @@ class ReaderOptions:
         self.staff = 1
         self.keep_chords = False
 
-class Measure(Base):
+def getBarlineType(has_style, style, repeat):
+    """ classify a barline location from its first bar-style text """
+    if not has_style:
+        return Measure.BARLINE_NORMAL
+    elif repeat:
+        return Measure.BARLINE_REPEAT
+    elif style == 'light-light':
+        return Measure.BARLINE_DOUBLE
+    elif style == 'light-heavy':
+        return Measure.BARLINE_FINAL
+    else:
+        return Measure.BARLINE_NORMAL
+
+class MeasureBuilder:
+    """ the data of a <measure> element, collected child by child """
+
+    def __init__(self, number):
+        self.number = number
+        self.segno = self.dal_segno = self.coda = self.to_coda = False
+        self.tempo = None
+        self.dal_segno_text = None
+        # location -> [has bar-style, first bar-style text, has repeat]
+        self.barlines = {'left': [False, None, False],
+                         'right': [False, None, False]}
+        self.attributes = None  # scanAttributes() fields of the first one
+        self.records = []
+
+    @classmethod
+    def fromValues(cls, number, flags, tempo, dal_segno_text, barlines,
+                   attributes, records):
+        builder = cls(number)
+        builder.segno, builder.dal_segno, builder.coda, builder.to_coda = flags
+        builder.tempo = tempo
+        builder.dal_segno_text = dal_segno_text
+        builder.barlines = barlines
+        builder.attributes = attributes
+        builder.records = [NoteRecord.fromValues(*values) for values in records]
+        return builder
+
+    def __reduce__(self):
+        return (MeasureBuilder.fromValues,
+                (self.number, (self.segno, self.dal_segno, self.coda, self.to_coda),
+                 self.tempo, self.dal_segno_text, self.barlines, self.attributes,
+                 [record.getValues() for record in self.records]))
+
+    def addNote(self, record):
+        self.records.append(record)
+
+    def addDirection(self, sounds, words):
+        """ add a <direction> from the attributes of its <sound> children and
+        the texts of its direction-type/words elements """
+        is_dal_segno = False
+        for sound in sounds:
+            if sound.get('segno') is not None:
+                self.segno = True
+            if sound.get('coda') is not None:
+                self.coda = True
+            if sound.get('tocoda') is not None:
+                self.to_coda = True
+            if sound.get('dalsegno') is not None:
+                self.dal_segno = is_dal_segno = True
+            tempo = sound.get('tempo')
+            if tempo is not None and self.tempo is None:
+                self.tempo = float(tempo)
+        if is_dal_segno and self.dal_segno_text is None:
+            for text in words:
+                if text is not None:
+                    self.dal_segno_text = text
+                    break
+
+    def addBarline(self, location, has_style, style, repeat):
+        barline = self.barlines.get(location)
+        if barline is not None:
+            if has_style and not barline[0]:
+                barline[0] = True
+                barline[1] = style
+            if repeat:
+                barline[2] = True
+
+def scanMeasure(elem, decode_notes=True):
+    """ return the MeasureBuilder of a <measure> element
+
+    Without decode_notes, the builder has no notes: the measure still has
+    its number, attributes, directions and barlines.
+    """
+    assert(elem.tag == 'measure')
+    builder = MeasureBuilder(elem.get('number'))
+    for child in elem:
+        tag = child.tag
+        if tag == 'note':
+            if decode_notes:
+                builder.addNote(decodeNote(child))
+        elif tag == 'direction':
+            builder.addDirection(
+                [sound.attrib for sound in child.iterchildren('sound')],
+                [words.text for words in child.iterfind('direction-type/words')])
+        elif tag == 'barline':
+            style = child.find('bar-style')
+            builder.addBarline(child.get('location'),
+                               style is not None,
+                               None if style is None else style.text,
+                               child.find('repeat') is not None)
+        elif tag == 'attributes' and builder.attributes is None:
+            builder.attributes = scanAttributes(child)
+    return builder
+
+class Measure:
 
     BARLINE_NORMAL = 'NORMAL'
     BARLINE_DOUBLE = 'DOUBLE'
@@ -230,59 +581,94 @@ class Measure(Base):
     _default_options = ReaderOptions()
 
     def __init__(self, elem, prev_measure=None, options = None):
-        assert(elem.tag == 'measure')
+        self._initFromBuilder(scanMeasure(elem), prev_measure, options)
+
+    @classmethod
+    def fromBuilder(cls, builder, prev_measure=None, options=None):
+        """ build a measure from data decoded without an element tree """
+        measure = cls.__new__(cls)
+        measure._initFromBuilder(builder, prev_measure, options)
+        return measure
+
+    def _initFromBuilder(self, builder, prev_measure, options):
         assert(not prev_measure or isinstance(prev_measure, Measure))
-        Base.__init__(self, elem)
 
         if options is None:
             options = Measure._default_options
 
+        self._number = builder.number
+        self._segno = builder.segno
+        self._dal_segno = builder.dal_segno
+        self._coda = builder.coda
+        self._to_coda = builder.to_coda
+        self._tempo = builder.tempo
+        self._dal_segno_text = builder.dal_segno_text
+        self._left_barline = getBarlineType(*builder.barlines['left'])
+        self._right_barline = getBarlineType(*builder.barlines['right'])
+
         prev_attributes = prev_measure.getAttributes() if prev_measure else None
-        attributes_elem = self._elem.find('attributes')
-        if not prev_attributes and attributes_elem is None:
+        if not prev_attributes and builder.attributes is None:
             raise MusicXMLParseError("attribute tag not found in first measure")
 
-        if attributes_elem is not None: # this measure contains attribute tag
-            self._attributes = Attributes(attributes_elem, prev_attributes)
+        if builder.attributes is not None: # this measure contains attribute tag
+            with profiling.stage('attributes'):
+                self._attributes = Attributes.fromValues(
+                    *resolveAttributes(builder.attributes, prev_attributes))
         else: # no attribute tag; inherit from previous measure
             self._attributes = prev_attributes
         assert(self._attributes is not None)
 
-        chords = []
-        for note_elem in self._elem.xpath('note'):
-            note = Note(note_elem, self._attributes)
-            if note.getStaff() != options.staff:
-                continue  # filter out notes of other staffs
-            if note.isChord():
+        records = builder.records
+        staff_chords = {}
+        for record in records:
+            note = Note.fromRecord(record, self._attributes)
+            chords = staff_chords.setdefault(record.staff, [])
+            if record.flags & NOTE_CHORD:
                 assert(chords)
                 chords[-1].append(note)
             else:
                 chords.append([note])
         if options.keep_chords:
-            self._notes = chords
+            self._staff_notes = staff_chords
         else:
-            self._notes = [chooseChordTonic(chord) for chord in chords]
+            self._staff_notes = {
+                staff: [chooseChordTonic(chord) for chord in chords]
+                for staff, chords in staff_chords.items()
+            }
+        self._notes = self._staff_notes.get(options.staff, [])
+        profiling.count('measures')
+        profiling.count('notes', len(records))
+
+    def selectStaff(self, staff):
+        """ return a copy of this measure holding the notes of another staff """
+        import copy
+        measure = copy.copy(self)
+        measure._notes = self._staff_notes.get(staff, [])
+        return measure
+
+    def getStaffList(self):
+        return sorted(self._staff_notes)
 
     def isSegno(self):
-        return self._get_bool('direction/sound[@segno]')
+        return self._segno
 
     def isDalSegno(self):
-        return self._get_bool('direction/sound[@dalsegno]')
+        return self._dal_segno
 
     def isCoda(self):
-        return self._get_bool('direction/sound[@coda]')
+        return self._coda
 
     def isToCoda(self):
-        return self._get_bool('direction/sound[@tocoda]')
+        return self._to_coda
 
     def getMeasureNumber(self):
-        return int(self._elem.get('number'))
+        return int(self._number)
 
     def getTempo(self):
-        return self._get_float('direction/sound/@tempo', default=0)
+        return self._tempo if self._tempo is not None else 0.0
 
     def getDalSegno(self):
-        return self._get_text('direction[sound[@dalsegno]]/direction-type/words')
+        return self._dal_segno_text
 
     def getAttributes(self):
         return self._attributes
@@ -290,78 +676,397 @@ class Measure(Base):
     def getNotes(self):
         return self._notes
 
-    def _getBarLine(self, location):
-        bar_style = self._elem.xpath(f'barline[@location="{location}"]/bar-style')
-        repeat = self._elem.xpath(f'barline[@location="{location}"]/repeat')
-        if not bar_style:
-            return Measure.BARLINE_NORMAL
-        elif repeat:
-            return Measure.BARLINE_REPEAT
-        elif bar_style[0].text == 'light-light':
-            return Measure.BARLINE_DOUBLE
-        elif bar_style[0].text == 'light-heavy':
-            return Measure.BARLINE_FINAL
-        else:
-            return Measure.BARLINE_NORMAL
-
     def getLeftBarlineType(self):
-        return self._getBarLine('left')
+        return self._left_barline
 
     def getRightBarlineType(self):
-        return self._getBarLine('right')
+        return self._right_barline
 
     def __iter__(self):
         for note in self._notes:
             yield note
 
-def readCompressedMusicXML(filename):
-    archive = zipfile.ZipFile(filename)
+ZIP_MAGIC = b'PK\x03\x04'
+
+class CompressedMusicXMLFile:
+    """ binary file object reading the score out of an open .mxl archive
+
+    The score is decompressed as it is read, so parsers fed from this file
+    never see the whole decompressed document at once.
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self._archive = None
+        self._member = None
+        try:
+            import zipfile  # kept off the startup path of uncompressed input
+            self._archive = zipfile.ZipFile(file)
+            container_root = etree.fromstring(
+                self._archive.read('META-INF/container.xml'))
+            musicxml_filename = ROOTFILE_XPATH(container_root)[0].attrib.get('full-path')
+            self._member = self._archive.open(musicxml_filename)
+        except Exception:
+            self.close()
+            raise MusicXMLParseError("failed to read compressed MusicXML")
+
+    def read(self, size=-1):
+        return self._member.read(size)
+
+    def close(self):
+        for f in (self._member, self._archive, self._file):
+            if f is not None:
+                f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def openMusicXML(filename, data=None):
+    """ return a binary file object with the (decompressed) MusicXML text
+
+    The file is opened once; compressed files are recognized by their
+    first bytes and decompressed while they are read. data, when given,
+    holds the document itself, which is then read in memory instead.
+    """
+    if data is not None:
+        f = io.BytesIO(data)
+    else:
+        f = open(filename, 'rb')
     try:
-        container_xml = archive.read('META-INF/container.xml')
-        container_root = etree.fromstring(container_xml)
-        musicxml_filename = container_root.xpath('rootfiles/rootfile')[0].attrib.get('full-path')
-        return archive.read(musicxml_filename)
-    except:
-        raise MusicXMLParseError("failed to read compressed MusicXML")
+        magic = f.read(len(ZIP_MAGIC))
+        f.seek(0)
+    except Exception:
+        f.close()
+        raise
+    if magic == ZIP_MAGIC:
+        return CompressedMusicXMLFile(f)
+    return f
 
-class MusicXMLReader(Base):
+def readCompressedMusicXML(filename):
+    """ return the decompressed MusicXML document of an .mxl file """
+    with openMusicXML(filename) as f:
+        return f.read()
+
+def parseStreamHeader(source, options):
+    """ parse up to the end of the first measure; return (root, first measure)
+
+    The returned root only holds the header elements (work, identification,
+    part-list, ...); the partially parsed part is detached from it.
+    """
+    root = None
+    context = etree.iterparse(source, events=('start', 'end'))
+    for event, elem in context:
+        if root is None:
+            root = elem
+            if root.tag != 'score-partwise':
+                raise MusicXMLParseError(f'unsupported root element: {root.tag}')
+        elif event == 'end' and elem.tag == 'measure':
+            measure = Measure(elem, None, options)
+            root.remove(elem.getparent())
+            return root, measure
+    raise MusicXMLParseError('no measure found')
+
+def iterStreamMeasures(source, partId, options):
+    """ yield the measures of a part while parsing the source incrementally
+
+    Each measure is decoded, detached from the document and cleared as
+    soon as it is closed, so the partially built tree never holds more than
+    the current measure.
+    """
+    in_part = False
+    prev_measure = None
+    context = etree.iterparse(source, events=('start', 'end'),
+                              tag=('part', 'measure'))
+    for event, elem in context:
+        if elem.tag == 'part':
+            if event == 'start':
+                in_part = elem.get('id') == partId
+            elif in_part:
+                break  # the rest of the document belongs to other parts
+            else:
+                elem.getparent().remove(elem)
+        elif event == 'end':
+            elem.getparent().remove(elem)
+            if in_part:
+                with profiling.stage('measures'):
+                    measure = Measure(elem, prev_measure, options)
+            elem.clear()  # measures keep no reference to their element
+            if in_part:
+                yield measure
+                prev_measure = measure
+
+DECODE_BATCH_MEASURES = 256  # measures decoded per task of a process pool
+
+_decode_elements = None  # measure elements of a decoding worker process
+
+def _initDecodeWorker(elements):
+    global _decode_elements
+    _decode_elements = elements
+
+def _decodeRange(start, stop):
+    return [scanMeasure(elem) for elem in _decode_elements[start:stop]]
+
+def decodeMeasuresParallel(elements, workers):
+    """ yield the MeasureBuilder of every <measure> element, in order
+
+    Ranges of measures are decoded into note records by worker processes,
+    which get the elements by fork; the caller stitches the builders into
+    measures, resolving the attributes chain as it goes. Without fork, the
+    elements are decoded in this process.
+    """
+    import multiprocessing
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        yield from map(scanMeasure, elements)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    starts = range(0, len(elements), DECODE_BATCH_MEASURES)
+    stops = [min(start + DECODE_BATCH_MEASURES, len(elements)) for start in starts]
+    with ProcessPoolExecutor(workers, multiprocessing.get_context('fork'),
+                             initializer=_initDecodeWorker,
+                             initargs=(elements,)) as executor:
+        for builders in executor.map(_decodeRange, starts, stops):
+            yield from builders
+
+def computePickup(first_measure):
+    pickup = 0
+    for note in first_measure.getNotes():
+        if isinstance(note, list):  # a chord, kept with keep_chords
+            note = chooseChordTonic(note)
+        nom, denom = note.getDisplayedDuration()
+        pickup += nom / denom
+    return pickup
+
+class MeasureIndex:
+    """ the measures of every part of a score, shared by all writers """
+
+    def __init__(self, part_measures):
+        self._part_measures = part_measures
+        self._note_counts = {}
+
+    def getMeasures(self, partId):
+        return self._part_measures[partId]
+
+    def getMeasureCount(self):
+        return max((len(measures) for measures in self._part_measures.values()),
+                   default=0)
+
+    def getNoteCounts(self, partId):
+        """ return the number of notes in every measure of a part """
+        counts = self._note_counts.get(partId)
+        if counts is None:
+            counts = [len(measure.getNotes())
+                      for measure in self._part_measures[partId]]
+            self._note_counts[partId] = counts
+        return counts
+
+class StaffReader:
+    """ reader interface over one staff of a score parsed by MusicXMLReader """
+
+    def __init__(self, reader, staff, part_measures):
+        self._reader = reader
+        self._staff = staff
+        self._part_measures = part_measures
+        self._index = MeasureIndex(part_measures)
+        first_part = reader.getPartIdList()[0]
+        self._pickup = computePickup(part_measures[first_part][0])
 
-    def __init__(self, filename, staff=None, keep_chords=None):
-        if zipfile.is_zipfile(filename):
-            root = etree.fromstring(readCompressedMusicXML(filename))
-        else:
-            root = etree.parse(filename).getroot()
-        if root.tag != 'score-partwise':
-            raise MusicXMLParseError(f'unsupported root element: {root.tag}')
+    def getStaff(self):
+        return self._staff
 
-        Base.__init__(self, root)
+    def isStreaming(self):
+        return False
+
+    def getWorkTitle(self):
+        return self._reader.getWorkTitle()
+
+    def getComposer(self):
+        return self._reader.getComposer()
+
+    def getInitialKeySignature(self):
+        return self._reader.getInitialKeySignature()
+
+    def getInitialTime(self):
+        return self._reader.getInitialTime()
+
+    def getInitialTempo(self):
+        return self._reader.getInitialTempo()
+
+    def getPickup(self):
+        return self._pickup
+
+    def getPartIdList(self):
+        return self._reader.getPartIdList()
+
+    def getMeasures(self, partId):
+        return self._part_measures[partId]
+
+    def getMeasureIndex(self):
+        return self._index
+
+    def iterMeasures(self, partId):
+        return iter(self._part_measures[partId])
+
+class ParsedScore:
+    """ everything MusicXMLReader extracts from a document, for ScoreCache """
+
+    def __init__(self, work_title, composer, parts, initial_attributes,
+                 initial_tempo, pickup, staff, measures):
+        self.work_title = work_title
+        self.composer = composer
+        self.parts = parts
+        self.initial_attributes = initial_attributes
+        self.initial_tempo = initial_tempo
+        self.pickup = pickup
+        self.staff = staff
+        self.measures = measures  # part id -> list of Measure
+
+class MusicXMLReader(Base):
+
+    def __init__(self, filename, staff=None, keep_chords=None, streaming=False,
+                 score_cache=None, backend='tree', decode_workers=1,
+                 data=None):
+        """ parse filename, or load it from score_cache when given
+
+        data, when given, holds the document to parse instead of filename,
+        see fromBytes().
+        score_cache is a cache.ScoreCache; it is not used in streaming mode,
+        which never holds the whole score. backend is one of READER_BACKENDS:
+        'tree' parses an element tree, 'events' decodes the measures from
+        parser events without building one (not in streaming mode).
+        With decode_workers > 1, the measures of the tree backend are decoded
+        by that many processes (not in streaming mode either).
+        """
+        if backend not in READER_BACKENDS:
+            raise ValueError(f'unknown reader backend: {backend}')
+        if backend == 'events' and streaming:
+            raise ValueError('streaming requires the tree backend')
+        if decode_workers > 1 and (backend != 'tree' or streaming):
+            raise ValueError('parallel decoding requires the tree backend '
+                             'without streaming')
+        self._filename = filename
+        self._data = data
+        self._streaming = streaming
+        self._decode_workers = decode_workers
+        self._measures = {}  # part id -> list of Measure, built on demand
+        self._index = None
         self._options = ReaderOptions()
         if staff is not None:
             self._options.staff = max(staff, 1)  # minimal staff value is 1
         if keep_chords is not None:
-            self._options.keep_cords = keep_chords
+            self._options.keep_chords = keep_chords
+
+        score_key = None
+        if score_cache is not None and not streaming:
+            score_key = score_cache.computeKey(filename, self._options.keep_chords,
+                                               data)
+            score = score_cache.get(score_key)
+            if score is not None:
+                self._loadScore(score)
+                self._checkStaff()
+                return
+
+        if backend == 'events':
+            self._loadScore(self._parseEvents())
+            self._checkStaff()
+            if score_key is not None:
+                score_cache.put(score_key, self.exportScore())
+            return
+
+        if streaming:
+            with openMusicXML(filename, data) as source, profiling.stage('parse'):
+                root, first_measure = parseStreamHeader(source, self._options)
+        else:
+            with openMusicXML(filename, data) as source, profiling.stage('parse'):
+                root = etree.parse(source).getroot()
+            if root.tag != 'score-partwise':
+                raise MusicXMLParseError(f'unsupported root element: {root.tag}')
 
-        self._parts = [x.attrib.get('id')
-                       for x in root.xpath('part-list/score-part')]
+        Base.__init__(self, root)
 
-        first_measure = next(self.iterMeasures(self._parts[0]))
+        self._parts = [x.attrib.get('id') for x in SCORE_PARTS_XPATH(root)]
+
+        if not streaming:
+            first_measure = self._buildFirstMeasure(self._parts[0])
         self._initial_attributes = first_measure.getAttributes()
         self._initial_tempo = first_measure.getTempo()
 
-        self._pickup = 0
-        for note in first_measure.getNotes():
-            nom, denom = note.getDisplayedDuration()
-            self._pickup += nom / denom
+        self._pickup = computePickup(first_measure)
+        self._checkStaff()
+
+        if score_key is not None:
+            score_cache.put(score_key, self.exportScore())
 
+    @classmethod
+    def fromBytes(cls, data, staff=None, keep_chords=None, streaming=False,
+                  score_cache=None, backend='tree', decode_workers=1):
+        """ parse a MusicXML or compressed .mxl document held in memory """
+        return cls(None, staff, keep_chords, streaming, score_cache,
+                   backend, decode_workers, bytes(data))
+
+    def _checkStaff(self):
+        staff = self._options.staff
         staves = self._initial_attributes.getStaves()
         if staff > staves:  # maximal staff value is staves
             raise ValueError(f'staff exceeds staves: {staff} vs {staves}')
 
+    def _parseEvents(self):
+        from eventreader import parseScoreEvents  # eventreader imports reader
+        with openMusicXML(self._filename, self._data) as source, \
+                profiling.stage('parse'):
+            target = parseScoreEvents(source, self._options)
+        parts = target.parts
+        measures = {part: target.measures.get(part, []) for part in parts}
+        first_measures = measures[parts[0]]
+        if not first_measures:
+            raise MusicXMLParseError(f'no measure found in part {parts[0]}')
+        first_measure = first_measures[0]
+        return ParsedScore(target.work_title, target.composer, parts,
+                           first_measure.getAttributes(), first_measure.getTempo(),
+                           computePickup(first_measure), self._options.staff,
+                           measures)
+
+    def _loadScore(self, score):
+        Base.__init__(self, None)
+        self._work_title = score.work_title
+        self._composer = score.composer
+        self._parts = score.parts
+        self._initial_attributes = score.initial_attributes
+        self._initial_tempo = score.initial_tempo
+        self._pickup = score.pickup
+        staff = self._options.staff
+        if staff != score.staff:
+            for part, measures in score.measures.items():
+                self._measures[part] = [measure.selectStaff(staff)
+                                        for measure in measures]
+            self._pickup = computePickup(self._measures[self._parts[0]][0])
+        else:
+            self._measures.update(score.measures)
+
+    def exportScore(self):
+        """ return the ParsedScore of this reader, decoding every part """
+        if self._streaming:
+            raise ValueError('a streaming reader does not keep the score')
+        return ParsedScore(self.getWorkTitle(), self.getComposer(), self._parts,
+                           self._initial_attributes, self._initial_tempo,
+                           self._pickup, self._options.staff,
+                           {part: self.getMeasures(part) for part in self._parts})
+
     def getWorkTitle(self):
-        return self._get_text('work/work-title')
+        if self._elem is None:  # loaded from a ScoreCache
+            return self._work_title
+        profiling.count('xpath')
+        results = WORK_TITLE_XPATH(self._elem)
+        return results[0] if results else None
 
     def getComposer(self):
-        return self._get_text("identification/creator[@type='composer']")
+        if self._elem is None:
+            return self._composer
+        profiling.count('xpath')
+        results = COMPOSER_XPATH(self._elem)
+        return results[0] if results else None
 
     def getInitialKeySignature(self):
         return self._initial_attributes.getKeySignature()
@@ -378,9 +1083,100 @@ class MusicXMLReader(Base):
     def getPartIdList(self):
         return self._parts
 
-    def iterMeasures(self, partId):
+    def getStaff(self):
+        return self._options.staff
+
+    def isStreaming(self):
+        return self._streaming
+
+    def splitStaves(self):
+        """ return a StaffReader for every staff, decoding each part once """
+        if self._streaming:
+            raise ValueError('splitting staves requires the whole score, '
+                             'not streaming')
+        staves = 1
+        all_measures = {}
+        for part in self._parts:
+            measures = self.getMeasures(part)
+            for measure in measures:
+                staves = max(staves, measure.getAttributes().getStaves())
+            all_measures[part] = measures
+
+        readers = []
+        for staff in range(1, staves + 1):
+            part_measures = {
+                part: [measure.selectStaff(staff) for measure in measures]
+                for part, measures in all_measures.items()
+            }
+            readers.append(StaffReader(self, staff, part_measures))
+        return readers
+
+    def getMeasureElements(self, partId):
+        """ return the <measure> elements of a part in the parsed document """
+        if self._elem is None or self._streaming:
+            raise ValueError('the reader does not keep the document')
+        profiling.count('xpath')
+        return PART_MEASURES_XPATH(self._elem, part=partId)
+
+    def _buildFirstMeasure(self, partId):
+        elements = self.getMeasureElements(partId)
+        if not elements:
+            raise MusicXMLParseError(f'no measure found in part {partId}')
+        with profiling.stage('measures'):
+            measure = Measure(elements[0], None, self._options)
+        self._first_measure = measure
+        return measure
+
+    def _buildMeasures(self, partId):
+        elements = self.getMeasureElements(partId)
+        builders = None
+        if self._decode_workers > 1 and len(elements) > DECODE_BATCH_MEASURES:
+            builders = decodeMeasuresParallel(elements, self._decode_workers)
+        measures = []
         prev_measure = None
-        for elem in self._elem.xpath(f"part[@id='{partId}']/measure"):
-            measure = Measure(elem, prev_measure, self._options)
-            yield measure
+        for elem in elements:
+            builder = None if builders is None else next(builders)
+            if prev_measure is None and partId == self._parts[0]:
+                measure = self._first_measure  # already built in __init__
+            elif builder is not None:
+                with profiling.stage('measures'):
+                    measure = Measure.fromBuilder(builder, prev_measure,
+                                                  self._options)
+            else:
+                with profiling.stage('measures'):
+                    measure = Measure(elem, prev_measure, self._options)
+            measures.append(measure)
             prev_measure = measure
+        return measures
+
+    def getMeasures(self, partId):
+        """ return the list of measures of a part
+
+        The measures are built once and kept for later calls, except in
+        streaming mode where the part is parsed again every time.
+        """
+        if self._streaming:
+            return list(self.iterMeasures(partId))
+        measures = self._measures.get(partId)
+        if measures is None:
+            measures = self._buildMeasures(partId)
+            self._measures[partId] = measures
+        return measures
+
+    def getMeasureIndex(self):
+        if self._streaming:
+            return MeasureIndex({part: self.getMeasures(part)
+                                 for part in self._parts})
+        if self._index is None:
+            self._index = MeasureIndex({part: self.getMeasures(part)
+                                        for part in self._parts})
+        return self._index
+
+    def iterMeasures(self, partId):
+        if self._streaming:
+            return self._iterStreamMeasures(partId)
+        return iter(self.getMeasures(partId))
+
+    def _iterStreamMeasures(self, partId):
+        with openMusicXML(self._filename, self._data) as source:
+            yield from iterStreamMeasures(source, partId, self._options)
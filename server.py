@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from converter import convert, staffArgument
+from writer import getGrammars
+
+DEFAULT_TIMEOUT = 30  # seconds
+DEFAULT_MAX_BODY = 64 * 1024 * 1024
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+class RequestError(Exception):
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+def parseOptions(query):
+    """ turn the query string of a request into convertFile options """
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    try:
+        options = dict(
+            grammar=params.get('grammar', getGrammars()[0]),
+            staff=staffArgument(params.get('staff', '1')),
+            ignore_key=params.get('ignore_key', '').lower() in TRUE_VALUES,
+            notes_per_line=int(params.get('notes_per_line', '0')),
+        )
+    except ValueError as e:
+        raise RequestError(400, f'invalid parameter: {e}')
+    if options['grammar'] not in getGrammars():
+        raise RequestError(400, f"unknown grammar: {options['grammar']}")
+    return options
+
+def runConversion(data, options):
+    """ worker entry point; conversion errors are returned, not raised """
+    try:
+        return True, convert(data, **options)
+    except Exception as e:  # report bad input to the client
+        return False, f'{type(e).__name__}: {e}'
+
+def workerLoop(connection):
+    """ run the conversions sent over connection until it is closed """
+    while True:
+        try:
+            data, options = connection.recv()
+        except EOFError:
+            return
+        connection.send(runConversion(data, options))
+
+class ConversionWorker:
+    """ a warm process running one conversion at a time
+
+    Unlike a pool process, the process can be killed while it converts,
+    so that a conversion running over its time does not hold it.
+    """
+
+    def __init__(self):
+        self._start()
+
+    def _start(self):
+        self._connection, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=workerLoop,
+                                                args=(child,), daemon=True)
+        self._process.start()
+        child.close()
+
+    def run(self, data, options, timeout):
+        """ return what runConversion() returns, or None after timeout
+        seconds, the process then being replaced """
+        try:
+            self._connection.send((data, options))
+            if self._connection.poll(timeout):
+                return self._connection.recv()
+        except (EOFError, OSError):
+            pass
+        self.restart()
+        return None
+
+    def restart(self):
+        self._process.kill()
+        self._process.join()
+        self._connection.close()
+        self._start()
+
+    def close(self):
+        self._connection.close()
+        self._process.join(1)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+
+    timeout = DEFAULT_TIMEOUT  # for reading a request from a stalled client
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self.sendText(200, json.dumps({'status': 'ok'}), 'application/json')
+        else:
+            self.sendText(404, 'not found')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            if url.path not in ('/', '/convert'):
+                raise RequestError(404, 'not found')
+            options = parseOptions(url.query)
+            data = self.readBody()
+            text = self.server.convert(data, options)
+        except RequestError as e:
+            self.sendText(e.status, str(e))
+        else:
+            self.sendText(200, text)
+
+    def readBody(self):
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            raise RequestError(411, 'Content-Length required')
+        if length > self.server.max_body:
+            raise RequestError(413, 'request body too large')
+        try:
+            return self.rfile.read(length)
+        except socket.timeout:
+            raise RequestError(408, 'request body timed out')
+
+    def sendText(self, status, text, content_type='text/plain'):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class ConversionServer(ThreadingHTTPServer):
+    """ HTTP server converting request bodies on a pool of warm processes
+
+    At most `workers` conversions run at once and as many more may wait
+    for a worker; further requests are rejected with 503 until one ends.
+    A conversion running over the timeout has its worker killed and
+    replaced before its slot is given back.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, workers=0, timeout=DEFAULT_TIMEOUT,
+                 max_body=DEFAULT_MAX_BODY, verbose=False):
+        ThreadingHTTPServer.__init__(self, address, ConversionRequestHandler)
+        workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.workers = [ConversionWorker() for _ in range(workers)]
+        self.idle_workers = queue.Queue()
+        for worker in self.workers:
+            self.idle_workers.put(worker)
+        self.slots = threading.BoundedSemaphore(workers * 2)
+        self.conversion_timeout = timeout
+        self.max_body = max_body
+        self.verbose = verbose
+
+    def convert(self, data, options):
+        if not self.slots.acquire(blocking=False):
+            raise RequestError(503, 'server busy')
+        try:
+            worker = self.idle_workers.get()
+            try:
+                result = worker.run(data, options, self.conversion_timeout)
+            finally:
+                self.idle_workers.put(worker)
+        finally:
+            self.slots.release()
+        if result is None:
+            raise RequestError(504, 'conversion timed out')
+        success, text = result
+        if not success:
+            raise RequestError(422, text)
+        return text
+
+    def server_close(self):
+        ThreadingHTTPServer.server_close(self)
+        for worker in self.workers:
+            worker.close()
+
+def serve(host, port, workers=0, timeout=DEFAULT_TIMEOUT, verbose=True):
+    server = ConversionServer((host, port), workers, timeout, verbose=verbose)
+    print(f'serving on http://{host}:{server.server_port}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import io
+import os
+from batch import *
+from test_reader import TEST_CASE_DIR, TempDirTestCase
+
+OPTIONS = dict(grammar='jianpu99', staff=1, ignore_key=False,
+               notes_per_line=0, streaming=False)
+
+def readFile(filename):
+    with open(filename, encoding='utf-8') as f:
+        return f.read()
+
+class TestBatch(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.output_dir = self.tmpdir.name
+
+    def test_createTasks(self):
+        tasks = createTasks([TEST_CASE_DIR,
+                             os.path.join(TEST_CASE_DIR, 'case1.*')],
+                            self.output_dir)
+        names = [os.path.basename(task.input_file) for task in tasks]
+        self.assertEqual(len(names), 9)  # case1 is not converted twice
+        self.assertIn('case3.mxl', names)
+        self.assertNotIn('case1.txt', names)
+        self.assertEqual(tasks[0].output_file,
+                         os.path.join(self.output_dir, 'case1.txt'))
+
+    def test_outputCollisions(self):
+        inputs = []
+        for path in ('a/x.musicxml', 'a/x.mxl', 'b/x.musicxml', 'b/y.xml'):
+            path = os.path.join(self.output_dir, 'in', path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'')
+            inputs.append(path)
+        output_dir = os.path.join(self.output_dir, 'out')
+        tasks = createTasks(inputs, output_dir)
+        self.assertEqual([task.error is None for task in tasks],
+                         [True, False, False, True])
+        self.assertIn(inputs[0], tasks[2].error)
+        results = runBatch(tasks[1:3], OPTIONS, 2)
+        self.assertTrue(all(r.error.startswith('OutputCollision') for r in results))
+        self.assertFalse(os.path.exists(output_dir))
+
+        tasks = createTasks([os.path.join(self.output_dir, 'in')], output_dir)
+        self.assertEqual([task.error is None for task in tasks],
+                         [True, False, True, True])
+
+    def test_runBatch(self):
+        bad_file = os.path.join(self.output_dir, 'bad.musicxml')
+        with open(bad_file, 'w') as f:
+            f.write('<score-timewise/>')
+        inputs = [os.path.join(TEST_CASE_DIR, name)
+                  for name in ('case1.musicxml', 'case3.mxl')] + [bad_file]
+        tasks = createTasks(inputs, self.output_dir)
+
+        for workers in (1, 2):
+            results = runBatch(tasks, OPTIONS, workers)
+            self.assertEqual([r.isSuccess() for r in results],
+                             [True, True, False])
+            self.assertTrue(results[2].error.startswith('MusicXMLParseError'))
+            for name in ('case1.txt', 'case3.txt'):
+                self.assertEqual(readFile(os.path.join(self.output_dir, name)),
+                                 readFile(os.path.join(TEST_CASE_DIR, name)))
+
+            summary = io.StringIO()
+            self.assertFalse(printSummary(results, summary))
+            self.assertIn('3 run, 2 converted, 1 failed', summary.getvalue())
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+from unittest import TestCase
+from benchmark import *
+
+def makeResults(**timings):
+    result = {f'{stage}_ms': 10.0 for stage in STAGES}
+    result.update(timings)
+    result['total_ms'] = sum(result[f'{stage}_ms'] for stage in STAGES)
+    return {'cases': {'case1.musicxml': result}}
+
+class TestBenchmark(TestCase):
+
+    def test_runCase(self):
+        result = runCase(os.path.join(TEST_CASE_DIR, 'case1.musicxml'),
+                         'jianpu99', repeat=1)
+        self.assertGreater(result['notes'], 0)
+        self.assertGreater(result['measures'], 0)
+        for stage in STAGES:
+            self.assertGreaterEqual(result[f'{stage}_ms'], 0)
+
+    def test_compareResults(self):
+        baseline = makeResults()
+        self.assertEqual(compareResults(baseline, makeResults(), 10), [])
+        self.assertEqual(compareResults(baseline, makeResults(parse_ms=10.5), 10), [])
+
+        regressions = compareResults(baseline, makeResults(parse_ms=12.0), 10)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('parse_ms', regressions[0])
+
+        # cases missing from the baseline are not compared
+        self.assertEqual(compareResults({'cases': {}}, makeResults(), 10), [])
+
+    def test_startupRegression(self):
+        baseline = dict(makeResults(), startup={'import_ms': 40.0, 'convert_ms': 60.0})
+        current = dict(makeResults(), startup={'import_ms': 41.0, 'convert_ms': 90.0})
+        regressions = compareResults(baseline, current, 10)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('convert_ms', regressions[0])
+
+        self.assertIsNone(checkStartupBudget(current, 100))
+        self.assertIn('convert_ms', checkStartupBudget(current, 80))
+
+class TestStartup(TestCase):
+
+    def test_deferredImports(self):
+        modules = getImportedModules('converter')
+        self.assertIn('lxml.etree', modules)
+        for module in DEFERRED_MODULES:
+            self.assertNotIn(module, modules)
+
+    def test_measureImportTime(self):
+        self.assertGreater(measureImportTime('profiling'), 0)
+
+    def test_zipapp(self):
+        from build_zipapp import buildZipapp
+        with tempfile.TemporaryDirectory() as tmpdir:
+            target = os.path.join(tmpdir, 'converter.pyz')
+            buildZipapp(target)
+            output = subprocess.run(
+                [sys.executable, target, os.path.join(TEST_CASE_DIR, 'case3.mxl')],
+                stdout=subprocess.PIPE, check=True).stdout
+        with open(os.path.join(TEST_CASE_DIR, 'case3.txt'), 'rb') as f:
+            self.assertEqual(output, f.read())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import os
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from cache import *
+from converter import convertFile
+from reader import MusicXMLReader
+from test_reader import TEST_CASE_DIR, TempDirTestCase
+
+OPTIONS = dict(grammar='jianpu99', staff=1, ignore_key=False, notes_per_line=0)
+
+class TestCacheKey(TestCase):
+
+    def test_keyDependsOnInputAndOptions(self):
+        key = computeCacheKey(b'<score-partwise/>', **OPTIONS)
+        self.assertEqual(key, computeCacheKey(b'<score-partwise/>', **OPTIONS))
+        self.assertNotEqual(key, computeCacheKey(b'<score-partwise />', **OPTIONS))
+        for name, value in (('grammar', 'jianpu-ly'), ('staff', 2),
+                            ('ignore_key', True), ('notes_per_line', 10)):
+            options = dict(OPTIONS)
+            options[name] = value
+            self.assertNotEqual(key, computeCacheKey(b'<score-partwise/>', **options))
+
+    def test_compressedInput(self):
+        # the key is computed on the inner document of compressed files
+        data = readMusicXMLBytes(os.path.join(TEST_CASE_DIR, 'case3.mxl'))
+        self.assertTrue(data.lstrip().startswith(b'<?xml'))
+
+class TestConversionCache(TempDirTestCase):
+
+    def test_hitSkipsConversion(self):
+        cache = ConversionCache(self.tmpdir.name)
+        filename = os.path.join(TEST_CASE_DIR, 'case1.musicxml')
+        with open(os.path.join(TEST_CASE_DIR, 'case1.txt'), encoding='utf-8') as f:
+            expected = f.read()
+
+        self.assertEqual(cache.convert(filename, **OPTIONS), expected)
+        with patch('cache.convertFile') as convertFile:
+            self.assertEqual(cache.convert(filename, **OPTIONS), expected)
+            convertFile.assert_not_called()
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_lruEviction(self):
+        cache = ConversionCache(self.tmpdir.name, max_bytes=250)
+        for key in ('a', 'b'):
+            cache.put(key, 'x' * 100)
+            time.sleep(0.01)
+        self.assertIsNotNone(cache.get('a'))  # 'a' becomes the most recent
+        time.sleep(0.01)
+        cache.put('c', 'x' * 100)
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+class TestScoreCache(TempDirTestCase):
+
+    def test_keyDependsOnContent(self):
+        filename = os.path.join(TEST_CASE_DIR, 'case1.musicxml')
+        key = computeScoreKey(filename)
+        self.assertEqual(key, computeScoreKey(filename))
+        self.assertNotEqual(key, computeScoreKey(filename, keep_chords=True))
+        self.assertNotEqual(key, computeScoreKey(
+            os.path.join(TEST_CASE_DIR, 'case2.musicxml')))
+        with patch('cache.READER_VERSION', 'other'):
+            self.assertNotEqual(key, computeScoreKey(filename))
+
+    def test_hitSkipsParsing(self):
+        cache = ScoreCache(self.tmpdir.name)
+        for name in ('case3.mxl', 'case7.musicxml'):
+            filename = os.path.join(TEST_CASE_DIR, name)
+            MusicXMLReader(filename, score_cache=cache)
+            for grammar in ('jianpu99', 'jianpu-ly'):
+                for staff in (1, 'all'):
+                    options = dict(OPTIONS, grammar=grammar, staff=staff)
+                    expected = convertFile(filename, **options)
+                    with patch('reader.etree.parse') as parse, \
+                         patch('reader.etree.fromstring') as fromstring:
+                        self.assertEqual(
+                            convertFile(filename, score_cache=cache, **options),
+                            expected)
+                    parse.assert_not_called()
+                    fromstring.assert_not_called()
+
+    def test_otherStaff(self):
+        cache = ScoreCache(self.tmpdir.name)
+        filename = os.path.join(TEST_CASE_DIR, 'case7.musicxml')
+        MusicXMLReader(filename, score_cache=cache)
+        reader = MusicXMLReader(filename, staff=2, score_cache=cache)
+        self.assertEqual(cache.hits, 1)
+        self.assertIsNone(reader._elem)
+        self.assertEqual(convertFile(filename, score_cache=cache, **dict(OPTIONS, staff=2)),
+                         convertFile(filename, **dict(OPTIONS, staff=2)))
+
+    def test_keepChords(self):
+        cache = ScoreCache(self.tmpdir.name)
+        filename = os.path.join(TEST_CASE_DIR, 'case7.musicxml')
+        MusicXMLReader(filename, score_cache=cache)
+        reader = MusicXMLReader(filename, keep_chords=True, score_cache=cache)
+        self.assertEqual(cache.hits, 0)  # cached without the chords
+        self.assertIsNotNone(reader._elem)
+        self.assertIsNotNone(cache.get(computeScoreKey(filename, keep_chords=True)))
+        MusicXMLReader(filename, keep_chords=True, score_cache=cache)
+        self.assertEqual(cache.hits, 2)
+
+    def test_invalidation(self):
+        cache = ScoreCache(self.tmpdir.name)
+        filename = os.path.join(TEST_CASE_DIR, 'case1.musicxml')
+        MusicXMLReader(filename, score_cache=cache)
+        key = computeScoreKey(filename)
+        self.assertIsNotNone(cache.get(key))
+        cache.clear()
+        self.assertIsNone(cache.get(key))
+
+        MusicXMLReader(filename, score_cache=cache)
+        with open(os.path.join(self.tmpdir.name, key + SCORE_SUFFIX), 'wb') as f:
+            f.write(b'truncated')
+        reader = MusicXMLReader(filename, score_cache=cache)  # parses again
+        self.assertIsNotNone(reader._elem)
+        self.assertIsNotNone(cache.get(key))
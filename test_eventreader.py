@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import glob
+import os
+from converter import convertFile
+from reader import MusicXMLParseError, MusicXMLReader, NoteRecord
+from test_reader import FAKE_MEASURES, TEST_CASE_DIR, TempDirTestCase
+
+def describeNote(note):
+    if isinstance(note, list):  # a chord, kept with keep_chords
+        return [describeNote(chord_note) for chord_note in note]
+    return [getattr(note.getRecord(), name) for name in NoteRecord.__slots__]
+
+def describeScore(reader):
+    """ everything the reader decoded, down to the note records """
+    result = [reader.getWorkTitle(), reader.getComposer(), reader.getPartIdList(),
+              reader.getPickup(), reader.getInitialTempo(),
+              reader.getInitialKeySignature(), reader.getInitialTime()]
+    for part in reader.getPartIdList():
+        for measure in reader.getMeasures(part):
+            fields = {name: value for name, value in vars(measure).items()
+                      if name not in ('_staff_notes', '_notes')}
+            fields['_staff_notes'] = {
+                staff: [describeNote(note) for note in notes]
+                for staff, notes in measure._staff_notes.items()}
+            result.append(fields)
+    return result
+
+SCORE_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<score-partwise>
+  <work><work-title>Title</work-title></work>
+  <identification>
+    <creator type="lyricist">Someone</creator>
+    <creator type="composer">Composer</creator>
+  </identification>
+  <part-list><score-part id="P1"/></part-list>
+  <part id="P1">{}</part>
+</score-partwise>
+"""
+
+EXTRA_MEASURE = """
+<measure number="5">
+  <attributes><divisions>4</divisions></attributes>
+  <attributes><divisions>8</divisions></attributes>
+  <direction>
+    <direction-type><words/></direction-type>
+    <direction-type><words>D.S.</words></direction-type>
+    <sound dalsegno="1" tempo="90"/>
+  </direction>
+  <barline location="left"><bar-style>heavy-light</bar-style><repeat direction="forward"/></barline>
+  <barline location="right"><bar-style>light-heavy</bar-style></barline>
+  <note default-y="5">
+    <pitch><step>B</step><alter>-1</alter><octave>3</octave></pitch>
+    <duration>2</duration>
+    <time-modification><actual-notes>3</actual-notes><normal-notes>2</normal-notes></time-modification>
+    <accidental>flat</accidental>
+    <staff>1</staff>
+    <notations>
+      <tuplet type="start"/>
+      <slide type="start" default-y="10"/>
+      <ornaments><tremolo>3</tremolo><tremolo>2</tremolo></ornaments>
+      <technical><string>2</string></technical>
+    </notations>
+  </note>
+  <note><chord/><pitch><step>D</step><octave>4</octave></pitch><duration>2</duration>
+    <notations><technical><string>1</string></technical></notations></note>
+</measure>
+"""
+
+class TestEventReader(TempDirTestCase):
+
+    def writeScore(self, text):
+        filename = os.path.join(self.tmpdir.name, 'score.musicxml')
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return filename
+
+    def assertSameScore(self, filename, **kwds):
+        self.assertEqual(describeScore(MusicXMLReader(filename, backend='events', **kwds)),
+                         describeScore(MusicXMLReader(filename, **kwds)))
+
+    def test_corpus(self):
+        filenames = (glob.glob(os.path.join(TEST_CASE_DIR, '*.musicxml')) +
+                     glob.glob(os.path.join(TEST_CASE_DIR, '*.mxl')))
+        for filename in sorted(filenames):
+            self.assertSameScore(filename)
+            for grammar in ('jianpu99', 'jianpu-ly'):
+                self.assertEqual(
+                    convertFile(filename, grammar, staff='all', backend='events'),
+                    convertFile(filename, grammar, staff='all'))
+
+    def test_measures(self):
+        filename = self.writeScore(SCORE_TEMPLATE.format(
+            ''.join(FAKE_MEASURES) + EXTRA_MEASURE))
+        self.assertSameScore(filename)
+        self.assertSameScore(filename, keep_chords=True)
+        reader = MusicXMLReader(filename, backend='events')
+        self.assertEqual(reader.getWorkTitle(), 'Title')
+        self.assertEqual(reader.getComposer(), 'Composer')
+        measure = reader.getMeasures('P1')[-1]
+        self.assertEqual(measure.getDalSegno(), 'D.S.')
+        self.assertEqual(measure.getAttributes().getDivisions(), 4)
+        self.assertEqual(measure.getNotes()[0].getString(), 1)
+
+    def test_textBeforeComments(self):
+        text = SCORE_TEMPLATE.format(''.join(FAKE_MEASURES) + EXTRA_MEASURE)
+        text = text.replace('<work-title>Title<',
+                            '<work-title>A &amp; B<!-- c --> C<')
+        text = text.replace('>Composer<', '>Com<?pi x?>poser<')
+        text = text.replace('<words>D.S.<', '<words>D.S.<b>x</b>y<')
+        self.assertSameScore(self.writeScore(text))
+        reader = MusicXMLReader(self.writeScore(text), backend='events')
+        self.assertEqual(reader.getWorkTitle(), 'A & B')
+        self.assertEqual(reader.getComposer(), 'Com')
+        self.assertEqual(reader.getMeasures('P1')[-1].getDalSegno(), 'D.S.')
+
+    def test_headerTextAfterComments(self):
+        text = SCORE_TEMPLATE.format(''.join(FAKE_MEASURES))
+        text = text.replace('<work-title>Title<',
+                            '<work-title><!-- c -->Test Title<')
+        text = text.replace('>Composer<', '><x>y</x><!-- c -->Composer<')
+        filename = self.writeScore(text)
+        self.assertSameScore(filename)
+        reader = MusicXMLReader(filename, backend='events')
+        self.assertEqual(reader.getWorkTitle(), 'Test Title')
+        self.assertEqual(reader.getComposer(), 'Composer')
+
+    def test_unsupportedRoot(self):
+        filename = self.writeScore('<score-timewise/>')
+        with self.assertRaises(MusicXMLParseError):
+            MusicXMLReader(filename, backend='events')
+
+    def test_options(self):
+        filename = os.path.join(TEST_CASE_DIR, 'case1.musicxml')
+        with self.assertRaises(ValueError):
+            MusicXMLReader(filename, backend='sax')
+        with self.assertRaises(ValueError):
+            MusicXMLReader(filename, streaming=True, backend='events')
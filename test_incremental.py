@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+from unittest import TestCase
+from cache import StateCache
+from converter import convertFile
+from incremental import *
+from test_reader import TEST_CASE_DIR, TempDirTestCase
+
+def editFirstStep(filename):
+    """ change the step of the first pitched note of the document """
+    with open(filename, encoding='utf-8') as f:
+        text = f.read()
+    index = text.index('<step>') + len('<step>')
+    step = 'D' if text[index] != 'D' else 'E'
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write(text[:index] + step + text[index + 1:])
+
+class TestScanMeasureSpans(TestCase):
+
+    def test_spans(self):
+        data = (b'<score-partwise><part-list><score-part id="P1">'
+                b'<part-name>x</part-name></score-part></part-list>'
+                b'<part id="P1"><!-- <measure> --><measure number="1">'
+                b'<note/></measure><measure number="2"/></part></score-partwise>')
+        spans = scanMeasureSpans(data)
+        self.assertEqual(list(spans), ['P1'])
+        self.assertEqual([data[start:stop] for start, stop in spans['P1']],
+                         [b'<measure number="1"><note/></measure>',
+                          b'<measure number="2"/>'])
+
+    def test_unsupported(self):
+        self.assertIsNone(scanMeasureSpans(
+            b'<?xml version="1.0" encoding="ISO-8859-1"?><score-partwise/>'))
+        self.assertIsNone(scanMeasureSpans(
+            b'<!DOCTYPE score-partwise [<!ENTITY x "y">]><score-partwise/>'))
+
+class TestIncrementalConverter(TempDirTestCase):
+
+    def test_sameAsConvertFile(self):
+        for name in ('case1.musicxml', 'case3.mxl', 'case6.musicxml', 'case7.musicxml'):
+            filename = os.path.join(TEST_CASE_DIR, name)
+            for grammar in ('jianpu99', 'jianpu-ly'):
+                for notes_per_line in (0, 12):
+                    converter = IncrementalConverter(filename, grammar,
+                                                     notes_per_line=notes_per_line)
+                    expected = convertFile(filename, grammar,
+                                           notes_per_line=notes_per_line)
+                    self.assertEqual(converter.convert(), expected)
+                    self.assertEqual(converter.convert(), expected)
+                    self.assertEqual(converter.rendered_measures, 0)
+
+    def test_onlyChangedMeasuresRendered(self):
+        filename = os.path.join(self.tmpdir.name, 'score.musicxml')
+        shutil.copyfile(os.path.join(TEST_CASE_DIR, 'case7.musicxml'), filename)
+        converter = IncrementalConverter(filename, 'jianpu-ly', notes_per_line=12)
+        converter.convert()
+        self.assertGreater(converter.rendered_measures, 1)
+
+        editFirstStep(filename)
+        output = converter.convert()
+        self.assertEqual(converter.rendered_measures, 1)
+        self.assertEqual(output, convertFile(filename, 'jianpu-ly', notes_per_line=12))
+
+    def test_stateCache(self):
+        filename = os.path.join(self.tmpdir.name, 'score.musicxml')
+        shutil.copyfile(os.path.join(TEST_CASE_DIR, 'case6.musicxml'), filename)
+        state_cache = StateCache(os.path.join(self.tmpdir.name, 'state'))
+        IncrementalConverter(filename, 'jianpu99', state_cache=state_cache).convert()
+
+        editFirstStep(filename)
+        converter = IncrementalConverter(filename, 'jianpu99', state_cache=state_cache)
+        self.assertEqual(converter.convert(), convertFile(filename, 'jianpu99'))
+        self.assertEqual(converter.rendered_measures, 1)
+        # another grammar has its own state
+        converter = IncrementalConverter(filename, 'jianpu-ly', state_cache=state_cache)
+        converter.convert()
+        self.assertGreater(converter.rendered_measures, 1)
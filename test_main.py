@@ -3,6 +3,14 @@
 import unittest
 from test_reader import *
 from test_writer import *
+from test_eventreader import *
+from test_batch import *
+from test_cache import *
+from test_incremental import *
+from test_watch import *
+from test_benchmark import *
+from test_profiling import *
+from test_server import *
 
 if __name__ == "__main__":
     unittest.main()
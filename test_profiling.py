@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import os
+from unittest import TestCase
+import profiling
+from reader import MusicXMLReader
+from test_reader import TEST_CASE_DIR
+from writer import createWriter
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 0.5
+        return self.now
+
+class TestProfiling(TestCase):
+
+    def tearDown(self):
+        profiling.disable()
+
+    def test_disabled(self):
+        self.assertFalse(profiling.isEnabled())
+        profiling.count('notes')  # no-op
+        with profiling.stage('parse'):
+            pass
+
+    def test_pluggableClock(self):
+        profiler = profiling.enable(profiling.Profiler(clock=FakeClock()))
+        for _ in range(2):
+            with profiling.stage('parse'):
+                pass
+        profiling.count('notes', 3)
+        self.assertEqual(profiler.timers['parse'], [1.0, 2])
+        self.assertEqual(profiler.counters['notes'], 3)
+        self.assertIn('parse', profiler.report())
+
+    def test_conversion(self):
+        profiler = profiling.enable()
+        reader = MusicXMLReader(os.path.join(TEST_CASE_DIR, 'case1.musicxml'))
+        output = createWriter('jianpu99').generate(reader)
+
+        for name in ('parse', 'measures', 'header', 'body', 'render'):
+            self.assertIn(name, profiler.timers)
+        counters = profiler.counters
+        self.assertGreater(counters['xpath'], 0)
+        self.assertGreater(counters['measures'], 0)
+        self.assertGreater(counters['notes'], 0)
+        self.assertEqual(counters['bytes'], len(output.encode('utf-8')))
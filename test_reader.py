@@ -1,10 +1,30 @@
 #!/usr/bin/env python3
 
+import os
+import tempfile
+import zipfile
 from unittest import TestCase
 from unittest.mock import patch
 from lxml import etree
 from reader import *
 
+TEST_CASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests')
+
+class TempDirTestCase(TestCase):
+    """ base of the test cases working in a temporary directory """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+def describeMeasures(measures):
+    return [(m.getMeasureNumber(), m.getAttributes().getTime(),
+             m.getRightBarlineType(), m.isSegno(),
+             [(n.isRest() or n.getPitch(), n.getDisplayedDuration()) for n in m])
+            for m in measures]
+
 class TestMeasure(TestCase):
 
     def setUp(self):
@@ -55,6 +75,29 @@ class TestMeasure(TestCase):
         self.assertEqual(a4.getKeySignature(), 'A')
         self.assertEqual(a4.getTime(), (6, 8))
 
+    def test_attributesInterned(self):
+        import copy
+        import pickle
+        a1, a2, a3, a4 = [m.getAttributes() for m in self.measures]
+        self.assertIs(a1, a2)
+        self.assertIsNot(a3, a4)
+        self.assertIs(Attributes.fromValues('C', (4, 4), 2, 1), a1)
+        Attributes.fromValues('C', (4, 4), 12345, 1)
+        self.assertNotIn(('C', (4, 4), 12345, 1), Attributes._interned)  # unused
+
+        # an attributes block repeating the current state shares the object
+        measure = Measure(etree.fromstring("""
+        <measure number="5">
+          <attributes><key><fifths>3</fifths></key></attributes>
+        </measure>
+        """), prev_measure=self.measures[3])
+        self.assertIs(measure.getAttributes(), a4)
+
+        with self.assertRaises(AttributeError):
+            a1._keysig = 'D'
+        self.assertIs(pickle.loads(pickle.dumps(a3)), a3)
+        self.assertIs(copy.deepcopy(a3), a3)
+
     def test_iterNotes(self):
         measure1_notes = [note for note in self.measures[0]]
         self.assertEqual(len(measure1_notes), 5)
@@ -112,6 +155,31 @@ class TestMeasure(TestCase):
         self.assertEqual(measure.getLeftBarlineType(), Measure.BARLINE_REPEAT)
         self.assertEqual(measure.getRightBarlineType(), Measure.BARLINE_DOUBLE)
 
+    def test_directions(self):
+        measure = Measure(etree.fromstring("""
+        <measure number="7">
+          <direction>
+            <direction-type><words>fine</words></direction-type>
+            <sound tempo="96"/>
+          </direction>
+          <direction>
+            <direction-type><words>D.S. al Coda</words></direction-type>
+            <sound dalsegno="segno" tempo="80"/>
+          </direction>
+          <direction><sound tocoda="coda"/></direction>
+        </measure>
+        """), prev_measure=self.measures[0])
+        self.assertEqual(measure.getMeasureNumber(), 7)
+        self.assertEqual(measure.getTempo(), 96)
+        self.assertTrue(measure.isDalSegno())
+        self.assertEqual(measure.getDalSegno(), 'D.S. al Coda')
+        self.assertTrue(measure.isToCoda())
+        self.assertFalse(measure.isSegno())
+        self.assertFalse(measure.isCoda())
+
+        self.assertEqual(self.measures[0].getTempo(), 0)
+        self.assertIsNone(self.measures[0].getDalSegno())
+
 class TestNote(TestCase):
 
     @patch('reader.Attributes')
@@ -314,6 +382,235 @@ class TestNote(TestCase):
 
         self.assertEqual(note1.getDisplayedDuration(), (3, 6))
 
+    def test_slide(self):
+        note = Note(etree.fromstring(
+            """
+            <note default-y="-20">
+                <pitch><step>E</step><octave>4</octave></pitch><duration>2</duration>
+                <notations>
+                  <slide type="start" default-y="-30"/>
+                </notations>
+            </note>
+            """), self.attributes)
+        self.assertTrue(note.isSlide())
+        self.assertTrue(note.isSlideStart())
+        self.assertFalse(note.isSlideStop())
+        self.assertTrue(note.isSlideUp())
+
+        note = Note(etree.fromstring(
+            """
+            <note default-y="-20">
+                <pitch><step>E</step><octave>4</octave></pitch><duration>2</duration>
+                <notations>
+                  <slide type="stop" default-y="-10"/>
+                </notations>
+            </note>
+            """), self.attributes)
+        self.assertFalse(note.isSlideStart())
+        self.assertTrue(note.isSlideStop())
+        self.assertFalse(note.isSlideUp())
+
+    def test_record(self):
+        note = Note(etree.fromstring(
+            """
+            <note>
+                <chord/>
+                <pitch><step>B</step><alter>-1</alter><octave>3</octave></pitch>
+                <duration>4</duration>
+                <voice>2</voice>
+                <staff>2</staff>
+                <notations>
+                  <ornaments><tremolo type="single">3</tremolo></ornaments>
+                  <technical><string>4</string><fret>2</fret></technical>
+                </notations>
+            </note>
+            """), self.attributes)
+        record = note.getRecord()
+        self.assertEqual(record.step, 'B')
+        self.assertEqual(record.octave, 3)
+        self.assertEqual(record.duration, 4)
+        self.assertTrue(note.isChord())
+        self.assertFalse(note.isRest())
+        self.assertEqual(note.getPitch(), ('Bb', 3))
+        self.assertEqual(note.getStaff(), 2)
+        self.assertEqual(note.getVoice(), 2)
+        self.assertEqual(note.getTremolo(), 3)
+        self.assertEqual(note.getString(), 4)
+
+        # records are reusable without the element
+        copy = Note.fromRecord(record, self.attributes)
+        self.assertEqual(copy.getPitch(), ('Bb', 3))
+        self.assertEqual(copy.getDuration(), (4, 2))
+
+class TestStreamingReader(TestCase):
+
+    def test_sameMeasures(self):
+        for name in ('case1.musicxml', 'case3.mxl', 'case7.musicxml'):
+            filename = os.path.join(TEST_CASE_DIR, name)
+            reader = MusicXMLReader(filename)
+            streaming = MusicXMLReader(filename, streaming=True)
+            self.assertTrue(streaming.isStreaming())
+            self.assertEqual(streaming.getWorkTitle(), reader.getWorkTitle())
+            self.assertEqual(streaming.getComposer(), reader.getComposer())
+            self.assertEqual(streaming.getPartIdList(), reader.getPartIdList())
+            self.assertEqual(streaming.getPickup(), reader.getPickup())
+            self.assertEqual(streaming.getInitialTempo(), reader.getInitialTempo())
+            for part in reader.getPartIdList():
+                self.assertEqual(describeMeasures(streaming.iterMeasures(part)),
+                                 describeMeasures(reader.iterMeasures(part)))
+
+    def test_measuresOutliveElements(self):
+        filename = os.path.join(TEST_CASE_DIR, 'case7.musicxml')
+        reader = MusicXMLReader(filename)
+        streaming = MusicXMLReader(filename, streaming=True)
+        part = reader.getPartIdList()[0]
+        # the elements are cleared while parsing; measures must not need them
+        self.assertEqual(describeMeasures(list(streaming.iterMeasures(part))),
+                         describeMeasures(reader.iterMeasures(part)))
+
+class TestFromBytes(TestCase):
+
+    def test_sameMeasures(self):
+        for name in ('case1.musicxml', 'case3.mxl', 'case7.musicxml'):
+            filename = os.path.join(TEST_CASE_DIR, name)
+            with open(filename, 'rb') as f:
+                data = f.read()
+            reader = MusicXMLReader(filename)
+            for streaming in (False, True):
+                in_memory = MusicXMLReader.fromBytes(memoryview(data),
+                                                     streaming=streaming)
+                self.assertEqual(in_memory.getWorkTitle(), reader.getWorkTitle())
+                self.assertEqual(in_memory.getPickup(), reader.getPickup())
+                for part in reader.getPartIdList():
+                    self.assertEqual(describeMeasures(in_memory.iterMeasures(part)),
+                                     describeMeasures(reader.iterMeasures(part)))
+
+    def test_brokenArchive(self):
+        with self.assertRaises(MusicXMLParseError):
+            MusicXMLReader.fromBytes(ZIP_MAGIC + b'broken')
+
+    def test_bytesFilename(self):
+        filename = os.path.join(TEST_CASE_DIR, 'case3.mxl')
+        reader = MusicXMLReader(filename)
+        for backend, streaming in (('tree', False), ('tree', True), ('events', False)):
+            by_path = MusicXMLReader(os.fsencode(filename), streaming=streaming,
+                                     backend=backend)
+            for part in reader.getPartIdList():
+                self.assertEqual(describeMeasures(by_path.iterMeasures(part)),
+                                 describeMeasures(reader.iterMeasures(part)))
+
+class TestCompressedMusicXML(TestCase):
+
+    def test_decompressWhileReading(self):
+        filename = os.path.join(TEST_CASE_DIR, 'case3.mxl')
+        with zipfile.ZipFile(filename) as archive:
+            names = [name for name in archive.namelist()
+                     if not name.startswith('META-INF')]
+            expected = archive.read(names[0])
+        with openMusicXML(filename) as f:
+            self.assertIsInstance(f, CompressedMusicXMLFile)
+            chunks = list(iter(lambda: f.read(4096), b''))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), expected)
+        self.assertEqual(readCompressedMusicXML(filename), expected)
+
+    def test_uncompressed(self):
+        filename = os.path.join(TEST_CASE_DIR, 'case1.musicxml')
+        with openMusicXML(filename) as f, open(filename, 'rb') as expected:
+            self.assertEqual(f.read(), expected.read())
+
+    def test_brokenArchive(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'broken.mxl')
+            with zipfile.ZipFile(filename, 'w') as archive:
+                archive.writestr('score.xml', '<score-partwise/>')
+            with self.assertRaises(MusicXMLParseError):
+                MusicXMLReader(filename)
+
+class TestSplitStaves(TestCase):
+
+    def test_matchesPerStaffReaders(self):
+        filename = os.path.join(TEST_CASE_DIR, 'case7.musicxml')
+        staff_readers = MusicXMLReader(filename).splitStaves()
+        self.assertEqual([r.getStaff() for r in staff_readers], [1, 2])
+        for staff_reader in staff_readers:
+            reader = MusicXMLReader(filename, staff_reader.getStaff())
+            self.assertEqual(staff_reader.getPickup(), reader.getPickup())
+            self.assertEqual(staff_reader.getPartIdList(), reader.getPartIdList())
+            for part in reader.getPartIdList():
+                self.assertEqual(describeMeasures(staff_reader.iterMeasures(part)),
+                                 describeMeasures(reader.iterMeasures(part)))
+
+    def test_singleStaff(self):
+        filename = os.path.join(TEST_CASE_DIR, 'case1.musicxml')
+        staff_readers = MusicXMLReader(filename).splitStaves()
+        self.assertEqual(len(staff_readers), 1)
+
+    def test_streaming(self):
+        filename = os.path.join(TEST_CASE_DIR, 'case7.musicxml')
+        with self.assertRaises(ValueError):
+            MusicXMLReader(filename, streaming=True).splitStaves()
+
+class TestMeasureIndex(TestCase):
+
+    def test_measuresBuiltOnce(self):
+        import profiling
+        from writer import createWriter
+        profiler = profiling.enable()
+        try:
+            reader = MusicXMLReader(os.path.join(TEST_CASE_DIR, 'case6.musicxml'))
+            for grammar in ('jianpu99', 'jianpu-ly', 'jianpu99'):
+                createWriter(grammar, notes_per_line=10).generate(reader)
+        finally:
+            profiling.disable()
+
+        index = reader.getMeasureIndex()
+        self.assertIs(index, reader.getMeasureIndex())
+        num_measures = sum(len(index.getMeasures(part))
+                           for part in reader.getPartIdList())
+        self.assertEqual(profiler.counters['measures'], num_measures)
+
+        part = reader.getPartIdList()[0]
+        self.assertIs(list(reader.iterMeasures(part))[0], index.getMeasures(part)[0])
+        self.assertEqual(index.getNoteCounts(part),
+                         [len(m.getNotes()) for m in index.getMeasures(part)])
+
+class TestParallelDecoding(TestCase):
+
+    def test_sameMeasures(self):
+        for name in ('case1.musicxml', 'case3.mxl', 'case6.musicxml', 'case7.musicxml'):
+            filename = os.path.join(TEST_CASE_DIR, name)
+            reader = MusicXMLReader(filename)
+            with patch('reader.DECODE_BATCH_MEASURES', 2):
+                parallel = MusicXMLReader(filename, decode_workers=2)
+                for part in reader.getPartIdList():
+                    measures = parallel.getMeasures(part)
+                    expected = reader.getMeasures(part)
+                    self.assertEqual(describeMeasures(measures),
+                                     describeMeasures(expected))
+                    self.assertEqual(
+                        [[n.getRecord().getValues() for n in m] for m in measures],
+                        [[n.getRecord().getValues() for n in m] for m in expected])
+                    self.assertEqual([m.getAttributes() for m in measures],
+                                     [m.getAttributes() for m in expected])
+
+    def test_buildersPickled(self):
+        import pickle
+        elem = etree.fromstring(FAKE_MEASURES[0])
+        builder = scanMeasure(elem)
+        copy = pickle.loads(pickle.dumps(builder))
+        self.assertEqual(describeMeasures([Measure.fromBuilder(copy)]),
+                         describeMeasures([Measure(elem)]))
+        self.assertEqual([record.getValues() for record in copy.records],
+                         [record.getValues() for record in builder.records])
+
+    def test_treeBackendOnly(self):
+        filename = os.path.join(TEST_CASE_DIR, 'case1.musicxml')
+        with self.assertRaises(ValueError):
+            MusicXMLReader(filename, streaming=True, decode_workers=2)
+        with self.assertRaises(ValueError):
+            MusicXMLReader(filename, backend='events', decode_workers=2)
+
 # ------------- TEST DATA -------------
 
 FAKE_MEASURES = [
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import socket
+import threading
+import urllib.error
+import urllib.request
+from unittest import TestCase
+from unittest.mock import patch
+from converter import convertFile
+from server import *
+from test_reader import TEST_CASE_DIR
+
+def readTestCase(name, mode='rb'):
+    with open(os.path.join(TEST_CASE_DIR, name), mode) as f:
+        return f.read()
+
+class TestServer(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ConversionServer(('127.0.0.1', 0), workers=1)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.thread.join()
+
+    def request(self, path, data=None):
+        try:
+            with urllib.request.urlopen(self.url + path, data, timeout=30) as response:
+                return response.status, response.read().decode('utf-8')
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode('utf-8')
+
+    def test_health(self):
+        self.assertEqual(self.request('/health'), (200, '{"status": "ok"}'))
+
+    def test_convert(self):
+        for name in ('case1.musicxml', 'case3.mxl'):
+            status, text = self.request('/convert', readTestCase(name))
+            self.assertEqual(status, 200)
+            expected = os.path.splitext(name)[0] + '.txt'
+            self.assertEqual(text, readTestCase(expected, 'r'))
+
+    def test_badRequests(self):
+        data = readTestCase('case1.musicxml')
+        self.assertEqual(self.request('/convert?grammar=abc', data)[0], 400)
+        self.assertEqual(self.request('/convert?notes_per_line=x', data)[0], 400)
+        self.assertEqual(self.request('/other', data)[0], 404)
+        status, text = self.request('/convert', b'<score-timewise/>')
+        self.assertEqual(status, 422)
+        self.assertIn('MusicXMLParseError', text)
+
+    def test_timeout(self):
+        timeout = self.server.conversion_timeout
+        self.server.conversion_timeout = 1e-6
+        try:
+            status, _ = self.request('/convert', readTestCase('case7.musicxml'))
+        finally:
+            self.server.conversion_timeout = timeout
+        self.assertEqual(status, 504)
+
+    def test_recoverFromTimeout(self):
+        data = readTestCase('case1.musicxml')
+        start = data.index(b'<measure')
+        stop = data.index(b'</part>')
+        slow = data[:start] + data[start:stop] * 1000 + data[stop:]
+        timeout = self.server.conversion_timeout
+        self.server.conversion_timeout = 0.2
+        try:
+            self.assertEqual(self.request('/convert', slow)[0], 504)
+            self.server.conversion_timeout = 1
+            status, text = self.request('/convert', data)
+        finally:
+            self.server.conversion_timeout = timeout
+        self.assertEqual(status, 200)
+        self.assertEqual(text, readTestCase('case1.txt', 'r'))
+
+    def test_stalledClient(self):
+        with patch.object(ConversionRequestHandler, 'timeout', 0.2), \
+             socket.create_connection(('127.0.0.1', self.server.server_port)) as client:
+            client.sendall(b'POST /convert HTTP/1.1\r\nContent-Length: 100\r\n\r\n')
+            client.settimeout(5)
+            self.assertTrue(client.recv(1024).startswith(b'HTTP/1.0 408'))
+
+class TestParseOptions(TestCase):
+
+    def test_options(self):
+        self.assertEqual(parseOptions('grammar=jianpu-ly&staff=all&ignore_key=true'
+                                      '&notes_per_line=8'),
+                         dict(grammar='jianpu-ly', staff='all', ignore_key=True,
+                              notes_per_line=8))
+        self.assertEqual(parseOptions('')['staff'], 1)
+
+class TestConvert(TestCase):
+
+    def test_noFiles(self):
+        for name in ('case1.musicxml', 'case3.mxl'):
+            data = readTestCase(name)
+            expected = readTestCase(os.path.splitext(name)[0] + '.txt', 'r')
+            with patch('builtins.open', side_effect=AssertionError('file opened')):
+                self.assertEqual(convert(data, **parseOptions('')), expected)
+
+    def test_convert(self):
+        data = readTestCase('case6.musicxml')
+        expected = convertFile(os.path.join(TEST_CASE_DIR, 'case6.musicxml'),
+                               'jianpu-ly', staff='all')
+        self.assertEqual(convert(data, 'jianpu-ly', staff='all'), expected)
+        self.assertEqual(convert(io.BytesIO(data), 'jianpu-ly', staff='all'), expected)
+        output = io.StringIO()
+        self.assertIsNone(convert(bytearray(data), 'jianpu-ly', output, staff='all'))
+        self.assertEqual(output.getvalue(), expected)
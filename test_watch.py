@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import shutil
+from converter import convertFile
+from test_reader import TEST_CASE_DIR, TempDirTestCase
+from watch import *
+
+def touch(filename, offset):
+    """ move the modification time of a file, as a save would """
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + offset))
+
+class TestWatcher(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.input_file = os.path.join(self.tmpdir.name, 'score.musicxml')
+        self.output_file = os.path.join(self.tmpdir.name, 'score.txt')
+        shutil.copyfile(os.path.join(TEST_CASE_DIR, 'case1.musicxml'), self.input_file)
+        self.log = io.StringIO()
+        self.watcher = Watcher([self.tmpdir.name], 'jianpu99', log=self.log)
+
+    def test_convertsNextToInputs(self):
+        self.assertEqual(self.watcher.poll(), [])  # settling
+        self.assertEqual(self.watcher.poll(),
+                         [(self.input_file, self.output_file, None)])
+        with open(self.output_file, encoding='utf-8') as f:
+            self.assertEqual(f.read(), convertFile(self.input_file, 'jianpu99'))
+        self.assertEqual(self.watcher.poll(), [])  # nothing changed
+
+    def test_debounce(self):
+        self.watcher.poll()
+        self.watcher.poll()
+        for offset in (1, 2, 3):  # saved again before every poll
+            touch(self.input_file, offset)
+            self.assertEqual(self.watcher.poll(), [])
+        self.assertEqual(len(self.watcher.poll()), 1)
+
+    def test_newAndFailingInputs(self):
+        self.watcher.poll()
+        self.watcher.poll()
+        broken_file = os.path.join(self.tmpdir.name, 'broken.musicxml')
+        with open(broken_file, 'w') as f:
+            f.write('<score-partwise>')
+        self.watcher.poll()
+        (result,) = self.watcher.poll()
+        self.assertEqual(result[0], broken_file)
+        self.assertIsNotNone(result[2])
+        self.assertIn('error: ', self.log.getvalue())
+        # the failure is not retried until the file changes again
+        self.assertEqual(self.watcher.poll(), [])
+
+    def test_outputCollision(self):
+        other_file = os.path.join(self.tmpdir.name, 'score.mxl')
+        shutil.copyfile(os.path.join(TEST_CASE_DIR, 'case3.mxl'), other_file)
+        self.watcher.poll()
+        results = self.watcher.poll()
+        self.assertEqual([result[2] is None for result in results], [True, False])
+        self.assertEqual(results[1][0], other_file)
+        self.assertIn('OutputCollision', results[1][2])
+        with open(self.output_file, encoding='utf-8') as f:
+            self.assertEqual(f.read(), convertFile(self.input_file, 'jianpu99'))
+
+    def test_outputMode(self):
+        self.watcher.poll()
+        self.watcher.poll()
+        reference_file = os.path.join(self.tmpdir.name, 'reference.txt')
+        with open(reference_file, 'w'):
+            pass
+        self.assertEqual(os.stat(self.output_file).st_mode,
+                         os.stat(reference_file).st_mode)
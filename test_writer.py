@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
+import os
 from unittest import TestCase
 from unittest.mock import patch
+from reader import MusicXMLReader
 from writer import *
+from test_reader import TEST_CASE_DIR
 
 class TestGenerateNote(TestCase):
 
@@ -157,6 +160,59 @@ class TestGenerateNote(TestCase):
         note.isTupletStop.return_value = False
         self.assertEqual(self.writer.generateNote(note), "1")
 
+class TestDurations(TestCase):
+
+    def test_decompose(self):
+        self.assertEqual(decomposeDuration(2, 2), (0, '', [0]))
+        self.assertEqual(decomposeDuration(8, 2), (3, '', [0]))
+        self.assertEqual(decomposeDuration(7, 2), (2, '.', [0]))
+        self.assertEqual(decomposeDuration(3, 4), (0, '.', [1]))
+        self.assertEqual(decomposeDuration(5, 4), (1, '', [0, 2]))
+
+    def test_jianpuLy(self):
+        writer = JianpuLyWriter()
+        self.assertEqual(writer.generateTimePrefixAndSuffix(8, 2), ('', ' - - -'))
+        self.assertEqual(writer.generateTimePrefixAndSuffix(1, 2), ('q', ''))
+        self.assertEqual(writer.generateTimePrefixAndSuffix(3, 4), ('q', '.'))
+        self.assertEqual(writer.generateTimePrefixAndSuffix(1, 16), ('h', ''))
+        with self.assertRaises(WriterError):
+            writer.generateTimePrefixAndSuffix(1, 32)
+
+    def test_pathological(self):
+        writer = Jianpu99Writer()
+        for duration, divisions in ((0, 2), (1, 3), (5, 6), (-2, 2)):
+            with self.assertRaises(WriterError):
+                writer.generateTimePrefixAndSuffix(duration, divisions)
+
+        # a long held note does not recurse once per quarter note
+        prefix, suffix = writer.generateTimePrefixAndSuffix(100000 * 480, 480)
+        self.assertEqual(suffix, ' -' * 99999)
+        self.assertEqual(writer.generateTimePrefixAndSuffix(3, 2**40 * 3), ('', '/' * 40))
+
+    def test_boundedCache(self):
+        writer = Jianpu99Writer()
+        for duration in range(1, TIME_CACHE_SIZE * 2):
+            writer.generateTimePrefixAndSuffix(duration * 2, 2)
+        self.assertEqual(len(writer._time_cache), TIME_CACHE_SIZE)
+
+class TestPitchTable(TestCase):
+
+    def test_tableMatchesRendering(self):
+        for grammar in getGrammars():
+            for ignore_key in (False, True):
+                writer = createWriter(grammar, ignore_key=ignore_key)
+                for keysig in ('C', 'D', 'Eb', 'F#'):
+                    table = writer.buildPitchTable(None if ignore_key else keysig)
+                    self.assertEqual(table[('C', 4)],
+                                     writer.renderPitch('C', 4, None if ignore_key else keysig))
+                    self.assertEqual(len(table), len(NOTE_DEGREE_TABLE) * 10)
+
+        writer = Jianpu99Writer()
+        self.assertEqual(writer.renderPitch('D', 4, 'D'), '1')
+        self.assertEqual(writer.renderPitch('Bb', 3, 'F'), '4,')
+        self.assertEqual(writer.renderPitch('A#', 5, None), "6#'")
+        self.assertEqual(JianpuLyWriter().renderPitch('Eb', 3, None), "b3,")
+
 class TestTranspose(TestCase):
 
     def test_transpose_pitch(self):
@@ -169,3 +225,85 @@ class TestTranspose(TestCase):
         self.assertEqual(getTransposeOffsetToC('C'), 0)
         self.assertEqual(getTransposeOffsetToC('G'), 5)
         self.assertEqual(getTransposeOffsetToC('F#'), -6)
+
+class TestIterGenerate(TestCase):
+
+    def test_sameAsGenerate(self):
+        for name in ('case1.musicxml', 'case6.musicxml', 'case7.musicxml'):
+            filename = os.path.join(TEST_CASE_DIR, name)
+            for grammar in getGrammars():
+                for notes_per_line in (0, 12):
+                    expected = createWriter(grammar, notes_per_line=notes_per_line
+                                            ).generate(MusicXMLReader(filename))
+                    for streaming in (False, True):
+                        reader = MusicXMLReader(filename, streaming=streaming)
+                        writer = createWriter(grammar, notes_per_line=notes_per_line)
+                        self.assertEqual(''.join(writer.iterGenerate(reader)), expected)
+
+class TestKeepChords(TestCase):
+
+    def test_renderChordTonics(self):
+        for name in ('case7.musicxml', 'case8.musicxml'):
+            filename = os.path.join(TEST_CASE_DIR, name)
+            for grammar in getGrammars():
+                expected = createWriter(grammar).generate(MusicXMLReader(filename))
+                reader = MusicXMLReader(filename, keep_chords=True)
+                self.assertEqual(createWriter(grammar).generate(reader), expected)
+
+class TestParallelRender(TestCase):
+
+    def test_sameAsSequential(self):
+        for name in ('case1.musicxml', 'case6.musicxml', 'case7.musicxml'):
+            reader = MusicXMLReader(os.path.join(TEST_CASE_DIR, name))
+            for grammar in getGrammars():
+                for notes_per_line in (0, 12):
+                    writer = createWriter(grammar, notes_per_line=notes_per_line)
+                    expected = writer.generate(reader)
+                    with patch('writer.RENDER_BATCH_LINES', 3):
+                        self.assertEqual(writer.generate(reader, workers=2), expected)
+
+    def test_linePlan(self):
+        lines = list(iterLinePlan([3, 1], 2))
+        self.assertEqual(lines, [(0, 0, 2, None), (1, 0, 1, (0, 1)), None,
+                                 (0, 2, 3, (1, 0)), (1, 1, 1, (0, 2)), None])
+
+class TestMeasureCache(TestCase):
+
+    def createMeasure(self, fifths, steps):
+        from lxml import etree
+        from reader import Measure
+        notes = ''.join(f'<note><pitch><step>{step}</step><octave>4</octave></pitch>'
+                        f'<duration>1</duration></note>' for step in steps)
+        return Measure(etree.fromstring(
+            f'<measure number="1"><attributes><divisions>1</divisions>'
+            f'<key><fifths>{fifths}</fifths></key>'
+            f'<time><beats>4</beats><beat-type>4</beat-type></time></attributes>'
+            f'{notes}</measure>'))
+
+    def test_reuseIdenticalMeasures(self):
+        writer = Jianpu99Writer()
+        text = writer.generateMeasure(self.createMeasure(0, 'CDEF'))
+        with patch.object(writer, 'generateNote') as generateNote:
+            self.assertEqual(writer.generateMeasure(self.createMeasure(0, 'CDEF')), text)
+            generateNote.assert_not_called()
+        # another key signature is rendered again
+        self.assertNotEqual(writer.generateMeasure(self.createMeasure(1, 'CDEF')), text)
+
+    def test_boundedCache(self):
+        writer = Jianpu99Writer()
+        with patch('writer.MEASURE_CACHE_SIZE', 3):
+            for steps in ('C', 'D', 'E', 'F', 'C'):
+                writer.generateMeasure(self.createMeasure(0, steps))
+        self.assertEqual(len(writer._measure_cache), 3)
+
+    def test_dropCacheOfDistinctMeasures(self):
+        writer = Jianpu99Writer()
+        with patch('writer.MEASURE_CACHE_PROBE', 4):
+            for steps in ('CC', 'CC', 'CD', 'CE'):
+                writer.generateMeasure(self.createMeasure(0, steps))
+            self.assertIsNotNone(writer._measure_cache)  # 1 hit in 4
+            for steps in ('CF', 'CG', 'CA', 'CB', 'DC', 'DD', 'DE', 'DF'):
+                writer.generateMeasure(self.createMeasure(0, steps))
+            self.assertIsNone(writer._measure_cache)  # 1 hit in 12
+            text = writer.generateMeasure(self.createMeasure(0, 'CC'))
+        self.assertEqual(text, writer.generateMeasure(self.createMeasure(0, 'CC')))
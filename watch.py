@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+import time
+
+from batch import createTasks, outputName
+from incremental import IncrementalConverter
+
+POLL_INTERVAL = 0.5  # seconds between two polls
+
+def getSignature(filename):
+    """ return what tells a modified file apart, or None if it is missing """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def writeText(filename, text):
+    """ replace a file at once, so that previewers never read it half written """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filename) or '.',
+                                    suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp_path, 0o666 & ~umask)  # mkstemp creates owner-only files
+    os.replace(tmp_path, filename)
+
+class Watcher:
+    """ converts watched inputs next to them whenever they are modified
+
+    Inputs are files, directories and glob patterns as in batch mode, and
+    are expanded again on every poll to pick up new files. Detection only
+    polls file times and sizes. A modified file is converted once it stayed
+    the same for a whole poll, so that a burst of saves is converted once.
+    Every input keeps an IncrementalConverter, which only renders the
+    measures changed since its previous conversion.
+    """
+
+    def __init__(self, inputs, grammar, staff=1, ignore_key=False,
+                 notes_per_line=0, state_cache=None, log=None):
+        self._inputs = inputs
+        self._options = dict(grammar=grammar, staff=staff,
+                             ignore_key=ignore_key,
+                             notes_per_line=notes_per_line,
+                             state_cache=state_cache)
+        self._log = log
+        self._converters = {}  # input file -> IncrementalConverter
+        self._converted = {}  # input file -> signature of the last conversion
+        self._pending = {}  # input file -> signature seen at the last poll
+        self._collisions = {}  # input file -> other input with its output file
+
+    def findInputs(self):
+        """ return the watched input files, noting those whose output file
+        is written for another input """
+        inputs = []
+        outputs = {}  # output file -> input file writing it
+        self._collisions = {}
+        for task in createTasks(self._inputs, ''):
+            input_file = task.input_file
+            output_key = os.path.normcase(os.path.abspath(outputName(input_file)))
+            other = outputs.setdefault(output_key, input_file)
+            if other != input_file:
+                self._collisions[input_file] = other
+            inputs.append(input_file)
+        return inputs
+
+    def poll(self):
+        """ convert the inputs that settled since the last poll; return
+        [(input file, output file, error or None)] """
+        results = []
+        inputs = self.findInputs()
+        for input_file in inputs:
+            signature = getSignature(input_file)
+            if signature is None or signature == self._converted.get(input_file):
+                self._pending.pop(input_file, None)
+            elif signature != self._pending.get(input_file):
+                self._pending[input_file] = signature  # wait for one more poll
+            else:
+                del self._pending[input_file]
+                self._converted[input_file] = signature
+                results.append(self.convert(input_file))
+        for input_file in set(self._converters) - set(inputs):
+            del self._converters[input_file]  # removed from the watched inputs
+            self._converted.pop(input_file, None)
+            self._pending.pop(input_file, None)
+        return results
+
+    def convert(self, input_file):
+        output_file = outputName(input_file)
+        other = self._collisions.get(input_file)
+        if other is not None:
+            error = f'OutputCollision: {output_file} is the output of {other}'
+            print(f'error: {input_file}: {error}', file=self._log)
+            return (input_file, output_file, error)
+        converter = self._converters.get(input_file)
+        if converter is None:
+            converter = IncrementalConverter(input_file, **self._options)
+            self._converters[input_file] = converter
+        try:
+            writeText(output_file, converter.convert())
+        except Exception as e:  # report the failure and keep watching
+            error = f'{type(e).__name__}: {e}'
+            print(f'error: {input_file}: {error}', file=self._log)
+            return (input_file, output_file, error)
+        print(f'ok: {input_file} -> {output_file}', file=self._log)
+        return (input_file, output_file, None)
+
+    def run(self, interval=POLL_INTERVAL):
+        """ poll until interrupted """
+        try:
+            while True:
+                self.poll()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
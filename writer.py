@@ -1,6 +1,11 @@
 #!/usr/bin/env python
 
-from reader import Measure
+import collections
+import itertools
+import math
+
+import profiling
+from reader import Measure, chooseChordTonic
 
 STEP_TO_NUMBER = {
     'C': 1,
@@ -38,6 +43,12 @@ NOTE_DEGREE_TABLE = {
 
 DEGREE_NOTE_TABLE = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
 
+PITCH_TABLE_OCTAVES = range(10)  # octaves rendered ahead of time
+TIME_CACHE_SIZE = 256  # distinct (duration, divisions) kept per writer
+MEASURE_CACHE_SIZE = 1024  # distinct measure bodies kept per writer
+MEASURE_CACHE_PROBE = 64  # lookups between checks of the cache hit rate
+MEASURE_CACHE_MIN_HIT_RATE = 0.125  # below which the cache is dropped
+
 def getTransposedPitch(note_name, octave, offset):
     degree = NOTE_DEGREE_TABLE[note_name]
     transposed_degree = degree + offset
@@ -63,6 +74,38 @@ def appendForTie(text, char):
 class WriterError(Exception):
     pass
 
+def decomposeDuration(duration, divisions):
+    """ split a note duration into (dashes, dot, halvings)
+
+    This is the closed form of rendering a duration one quarter note at a
+    time: `dashes` is the number of ' -' marks, `dot` is '.' for a dotted
+    ending and `halvings` lists how many times the remaining duration was
+    doubled to reach a quarter note between two consecutive dashes.
+    """
+    if duration <= 0 or divisions <= 0:
+        raise WriterError(f'unsupported note duration {duration}/{divisions}')
+    # the process only ends when the duration is a dyadic fraction of a
+    # quarter note; anything else (e.g. 1/3) would be halved forever
+    denominator = divisions // math.gcd(duration, divisions)
+    if denominator & (denominator - 1):
+        raise WriterError(f'unsupported note duration {duration}/{divisions}')
+
+    dashes = 0
+    halvings = [0]
+    while True:
+        if duration < divisions:
+            shift = (-(-divisions // duration) - 1).bit_length()
+            halvings[-1] += shift
+            duration <<= shift
+        quarters, remainder = divmod(duration, divisions)
+        if remainder == 0:
+            return dashes + quarters - 1, '', halvings
+        if remainder * 2 == divisions:
+            return dashes + quarters - 1, '.', halvings
+        dashes += quarters
+        duration = remainder
+        halvings.append(0)
+
 class WriterOptions:
 
     def __init__(self):
@@ -84,6 +127,14 @@ class BaseWriter:
     def __init__(self, **kwds):
         self._options = WriterOptions()
         self._dict = WriterDict()
+        self._pitch_tables = {}  # key signature -> {(note_name, octave): text}
+        self._pitch_table_attributes = None  # last seen attributes
+        self._pitch_table_keysig = None  # and their table
+        self._pitch_table = None
+        self._time_cache = collections.OrderedDict()
+        self._measure_cache = collections.OrderedDict()  # None once dropped
+        self._measure_lookups = 0
+        self._measure_hits = 0
         for key, value in kwds.items():
             if value is None:
                 pass
@@ -92,6 +143,12 @@ class BaseWriter:
             if hasattr(self._dict, key):
                 setattr(self._dict, key, value)
 
+    def getSettings(self):
+        """ return all writer options and dictionary entries as a dict """
+        settings = dict(vars(self._options))
+        settings.update(vars(self._dict))
+        return settings
+
     def toHeader(self, title, key, beats, beat_type, tempo, composer):
         raise NotImplementedError()
 
@@ -110,8 +167,29 @@ class BaseWriter:
     def toTieStart(self, text):
         return f'( {text}'
 
-    def generate(self, reader):
-        return self.generateHeader(reader) + '\n' + self.generateBody(reader)
+    def generate(self, reader, workers=1):
+        with profiling.stage('header'):
+            header = self.generateHeader(reader)
+        with profiling.stage('body'):
+            body = self.generateBody(reader, workers)
+        result = header + '\n' + body
+        if profiling.isEnabled():
+            profiling.count('bytes', len(result.encode('utf-8')))
+        return result
+
+    def iterGenerate(self, reader, workers=1):
+        """ yield the text of generate() piece by piece as lines are ready """
+        header = self.generateHeader(reader) + '\n'
+        if profiling.isEnabled():
+            profiling.count('bytes', len(header.encode('utf-8')))
+        yield header
+        separator = ''
+        for line in self.iterBody(reader, workers):
+            piece = separator + line
+            if profiling.isEnabled():
+                profiling.count('bytes', len(piece.encode('utf-8')))
+            yield piece
+            separator = '\n'
 
     def generateHeader(self, reader):
         title = reader.getWorkTitle()
@@ -126,41 +204,131 @@ class BaseWriter:
         composer = reader.getComposer()
         return self.toHeader(title, key, beats, beat_type, tempo, pickup, composer)
 
-    def generateBody(self, reader):
-        parts = reader.getPartIdList()
-
-        part_measures = dict()
-        for part in parts:
-            part_measures[part] = list(reader.iterMeasures(part))
-
-        lines = []
+    def generateBody(self, reader, workers=1):
+        return '\n'.join(self.iterBody(reader, workers))
 
-        measure_count = max(len(measures) for measures in part_measures.values())
-        num_measures_per_line = self.computeNumMeasuresPerLine(part_measures.values())
-        for i in range(0, measure_count, num_measures_per_line):
-            begin = i
-            end = min(i + num_measures_per_line, measure_count)
-            for part_index, part in enumerate(parts):
-                line = self.toLinePrefix(part_index, len(parts))
-                line += self.generateMeasures(part_measures[part][begin:end])
-                line += self._dict.line_suffix
-                lines.append(line)
-            lines.append('') # empty line
+    def iterBody(self, reader, workers=1):
+        """ yield the body lines, consuming the measures group by group
 
-        return '\n'.join(lines)
-
-    def generateMeasures(self, measureList):
+        With workers > 1 the lines are rendered on a process pool and
+        reassembled in order, with the same output. Streaming readers are
+        always rendered in this process, as they do not keep the measures
+        the workers would need.
+        """
+        parts = reader.getPartIdList()
+        num_measures_per_line = self.getNumMeasuresPerLine(reader, parts)
+        if workers > 1 and not reader.isStreaming():
+            part_measures = [reader.getMeasures(part) for part in parts]
+            rendered = renderLinesParallel(self, part_measures,
+                                           num_measures_per_line, workers)
+        else:
+            rendered = self.renderLines(
+                self.iterLines(reader, parts, num_measures_per_line))
+        for part_index, text in rendered:
+            yield self.toLine(part_index, len(parts), text)
+
+    def toLine(self, part_index, num_parts, text):
+        """ return a body line for renderLines() output """
+        if part_index is None:
+            return '' # empty line
+        return self.toLinePrefix(part_index, num_parts) + text + self._dict.line_suffix
+
+    def getNumMeasuresPerLine(self, reader, parts):
+        if self._options.notes_per_line > 0:
+            return self.computeNumMeasuresPerLineFromCounts(
+                self.getNoteCounts(reader, parts))
+        return self._options.max_measures_per_line
+
+    def iterLines(self, reader, parts, num_measures_per_line):
+        """ yield (part index, measures, previous measure) for every line
+
+        Lines come in output order: one per part for every group of
+        measures, then None to end the group. The previous measure is the
+        one rendered right before the line in that order, which is all a
+        line needs from the lines before it.
+        """
+        part_iterators = [reader.iterMeasures(part) for part in parts]
+        prev_measure = None
+        while True:
+            groups = [list(itertools.islice(measures, num_measures_per_line))
+                      for measures in part_iterators]
+            if not any(groups):
+                break
+            for part_index, measures in enumerate(groups):
+                yield part_index, measures, prev_measure
+                if measures:
+                    prev_measure = measures[-1]
+            yield None
+
+    def renderLines(self, lines):
+        """ yield (part index, text) for iterLines(), or (None, None) """
+        for line in lines:
+            if line is None:
+                yield None, None
+                continue
+            part_index, measures, prev_measure = line
+            with profiling.stage('render'):
+                yield part_index, self.generateMeasures(measures, prev_measure)
+
+    def getNoteCounts(self, reader, parts):
+        if reader.isStreaming():  # count in a separate pass to keep memory flat
+            return [[len(measure.getNotes()) for measure in reader.iterMeasures(part)]
+                    for part in parts]
+        index = reader.getMeasureIndex()
+        return [index.getNoteCounts(part) for part in parts]
+
+    def generateMeasures(self, measureList, prev_measure=None, bodies=None):
+        """ render measures on one line; prev_measure was rendered before
+
+        bodies optionally holds the generateMeasure() text of every measure.
+        """
         result = ''
         for i, measure in enumerate(measureList):
-            result += self.toLeftBarline(i, measure)
+            result += self.toLeftBarline(i, measure, prev_measure)
             result += ' '
-            result += self.generateMeasure(measure)
+            if bodies is None:
+                result += self.generateMeasure(measure)
+            else:
+                result += bodies[i]
             result += ' '
             result += self.toRightBarline(measure)
+            prev_measure = measure
         return result
 
     def generateMeasure(self, measure):
-        pieces = [self.generateNote(note) for note in measure]
+        """ render the notes of a measure, reusing the text of an identical one
+
+        Measures are identical when their attributes, which carry the key
+        signature and divisions, and the records of their notes are equal.
+        Building that key costs about as much as rendering, so the cache is
+        dropped for scores where too few measures repeat.
+        """
+        notes = measure.getNotes()
+        if notes and isinstance(notes[0], list):  # chords kept by the reader
+            notes = [chooseChordTonic(chord) for chord in notes]
+        cache = self._measure_cache
+        if cache is None:
+            return self.renderNotes(notes)
+        key = (measure.getAttributes(),
+               tuple([note.getRecord().getValues() for note in notes]))
+        result = cache.get(key)
+        if result is None:
+            result = self.renderNotes(notes)
+            cache[key] = result
+            if len(cache) > MEASURE_CACHE_SIZE:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+            self._measure_hits += 1
+        self._measure_lookups += 1
+        if self._measure_lookups % MEASURE_CACHE_PROBE == 0 and \
+                self._measure_hits < self._measure_lookups * MEASURE_CACHE_MIN_HIT_RATE:
+            self._measure_cache = None
+        return result
+
+    def renderNotes(self, notes):
+        pieces = [self.generateNote(note) for note in notes]
+        profiling.count('rendered_notes', len(pieces))
         return ' '.join(pieces)
 
     def generateNote(self, note):
@@ -186,44 +354,78 @@ class BaseWriter:
     def generateBasicNote(self, note):
         if note.isRest():
             return '0'
+        (note_name, octave) = note.getPitch()
+        attributes = note.getAttributes()
+        if attributes is not self._pitch_table_attributes:
+            # attributes are interned, so this only runs when they change
+            keysig = None
+            if not self._options.ignore_key:
+                keysig = attributes.getKeySignature()
+            table = self._pitch_tables.get(keysig)
+            if table is None:
+                table = self.buildPitchTable(keysig)
+                self._pitch_tables[keysig] = table
+            self._pitch_table_attributes = attributes
+            self._pitch_table_keysig = keysig
+            self._pitch_table = table
+
+        table = self._pitch_table
+        text = table.get((note_name, octave))
+        if text is None:  # octave outside of the precomputed range
+            text = self.renderPitch(note_name, octave, self._pitch_table_keysig)
+            table[(note_name, octave)] = text
+        return text
+
+    def buildPitchTable(self, keysig):
+        """ render every note name and common octave in a key signature """
+        return {(note_name, octave): self.renderPitch(note_name, octave, keysig)
+                for note_name in NOTE_DEGREE_TABLE
+                for octave in PITCH_TABLE_OCTAVES}
+
+    def renderPitch(self, note_name, octave, keysig):
+        """ render a pitch, transposed from keysig to C unless keysig is None """
+        if keysig is not None and keysig != 'C':
+            offset = getTransposeOffsetToC(keysig)
+            (note_name, octave) = getTransposedPitch(note_name, octave, offset)
+
+        step = note_name[0:1] # C, D, E, F, G, A, B
+        accidental = note_name[1:2] # sharp (#) and flat (b)
+        if accidental == '#':
+            accidental = self._dict.sharp
+        elif accidental == 'b':
+            accidental = self._dict.flat
+
+        return self.toNote(stepToNumber(step), accidental, generateOctaveMark(octave))
+
+    def generateTimePrefixAndSuffix(self, duration, divisions):
+        key = (duration, divisions)
+        cache = self._time_cache
+        result = cache.get(key)
+        if result is None:
+            result = self.toTimePrefixAndSuffix(*decomposeDuration(duration, divisions))
+            cache[key] = result
+            if len(cache) > TIME_CACHE_SIZE:
+                cache.popitem(last=False)
         else:
-            pitch = note.getPitch()
-            (note_name, octave) = note.getPitch()
+            cache.move_to_end(key)
+        return result
 
-            if not self._options.ignore_key:
-                keysig = note.getAttributes().getKeySignature()
-                if keysig != 'C':
-                    offset = getTransposeOffsetToC(keysig)
-                    (note_name, octave) = getTransposedPitch(note_name, octave, offset)
-
-            step = note_name[0:1] # C, D, E, F, G, A, B
-            accidental = note_name[1:2] # sharp (#) and flat (b)
-            if accidental == '#':
-                accidental = self._dict.sharp
-            elif accidental == 'b':
-                accidental = self._dict.flat
-
-            return self.toNote(stepToNumber(step), accidental, generateOctaveMark(octave))
-
-    def generateTimePrefixAndSuffix(self, duration, divisions, prefix=''):
-        if duration < divisions: # less than quarter notes: add / and continue
-            return self.toShortTimePrefixAndSuffix(duration, divisions, prefix)
-        elif duration == divisions: # quarter notes
-            return prefix, ''
-        elif duration * 2 == divisions * 3: # syncopated notes
-            return prefix, '.'
-        else: # sustained more than 1.5 quarter notes: add - and continue
-            prefix, suffix = self.generateTimePrefixAndSuffix(duration - divisions, divisions)
-            return prefix, ' -' + suffix
+    def toTimePrefixAndSuffix(self, dashes, dot, halvings):
+        raise NotImplementedError()
 
     def computeNumMeasuresPerLine(self, collection_of_measures, cutoff=2):
+        return self.computeNumMeasuresPerLineFromCounts(
+            [[len(measure.getNotes()) for measure in measures]
+             for measures in collection_of_measures], cutoff)
+
+    def computeNumMeasuresPerLineFromCounts(self, collection_of_counts, cutoff=2):
+        """ same as computeNumMeasuresPerLine on per-measure note counts """
         result = self._options.max_measures_per_line
         if self._options.notes_per_line > 0:
-            for measures in collection_of_measures:
+            for counts in collection_of_counts:
                 num_measures = 0
                 num_notes = 0
-                for measure in measures:
-                    count = len(measure.getNotes())
+                for count in counts:
                     if count > cutoff:
                         num_measures += 1
                         num_notes += count
@@ -273,12 +475,10 @@ class Jianpu99Writer(BaseWriter):
         else:
             return f'{text}&xhy'
 
-    def toShortTimePrefixAndSuffix(self, duration, divisions, prefix):
-        assert(duration < divisions)
-        prefix, suffix = self.generateTimePrefixAndSuffix(duration * 2, divisions, prefix)
-        return prefix, suffix + '/'
+    def toTimePrefixAndSuffix(self, dashes, dot, halvings):
+        return '', ' -' * dashes + dot + '/' * sum(halvings)
 
-    def toLeftBarline(self, index, measure):
+    def toLeftBarline(self, index, measure, prev_measure=None):
         result = ''
         if measure.getLeftBarlineType() == Measure.BARLINE_REPEAT:
             if index == 0:
@@ -338,7 +538,6 @@ class JianpuLyWriter(BaseWriter):
             line_suffix = r'\break',
         ))
         BaseWriter.__init__(self, *args, **kwds)
-        self.right_after_final_bar = False
 
     def toHeader(self, title, key, beats, beat_type, tempo, pickup, composer):
         header = ''
@@ -386,20 +585,19 @@ class JianpuLyWriter(BaseWriter):
     def toTieStart(self, text):
         return appendForTie(text, '(')
 
-    def toShortTimePrefixAndSuffix(self, duration, divisions, prefix):
-        assert(duration < divisions)
-        for i in range(len(LY_TIME_PREFIXES) - 1):
-            if prefix == LY_TIME_PREFIXES[i]:
-                return self.generateTimePrefixAndSuffix(
-                    duration * 2, divisions, LY_TIME_PREFIXES[i + 1])
-        raise ValueError('Too short a note duration')
+    def toTimePrefixAndSuffix(self, dashes, dot, halvings):
+        if max(halvings) >= len(LY_TIME_PREFIXES):
+            raise WriterError('Too short a note duration')
+        return LY_TIME_PREFIXES[halvings[-1]], ' -' * dashes + dot
 
-    def toLeftBarline(self, index, measure):
+    def toLeftBarline(self, index, measure, prev_measure=None):
         ly_lines = []
         if measure.getLeftBarlineType() == Measure.BARLINE_REPEAT:
             ly_lines.append(r'\bar ".|:"')
 
-        if self.right_after_final_bar:  # add an invisible measure
+        if (prev_measure is not None and
+                prev_measure.getRightBarlineType() == Measure.BARLINE_FINAL):
+            # add an invisible measure
             beats, beat_type = measure.getAttributes().getTime()
             ly_lines = [
                 r'\once \override Score.BarNumber.break-visibility = ##(#f #f #f)',
@@ -408,7 +606,6 @@ class JianpuLyWriter(BaseWriter):
                 r'\bar "|"',
                 fr'\set Score.currentBarNumber = #{measure.getMeasureNumber()}',
             ]
-            self.right_after_final_bar = False
 
         if measure.isSegno():
             ly_lines.append(wrapLyMark(r'\musicglyph #"scripts.segno"', raw=True))
@@ -423,7 +620,6 @@ class JianpuLyWriter(BaseWriter):
         elif measure.getRightBarlineType() == Measure.BARLINE_DOUBLE:
             ly_lines.append(r'\bar "||"')
         elif measure.getRightBarlineType() == Measure.BARLINE_FINAL:
-            self.right_after_final_bar = True
             ly_lines.append(r'\bar "|."')
         # else: use auto barline
 
@@ -433,6 +629,82 @@ class JianpuLyWriter(BaseWriter):
             ly_lines.insert(0, wrapLyMark('To \musicglyph #"scripts.coda"', raw=True))
         return wrapLy(ly_lines)
 
+RENDER_BATCH_LINES = 64  # lines rendered per task of a process pool
+
+def iterLinePlan(part_lengths, num_measures_per_line):
+    """ yield (part index, start, stop, previous) like BaseWriter.iterLines
+
+    Measures are given by position: lines span [start, stop) of their part,
+    and previous is the (part index, position) of the measure rendered
+    before the line, or None.
+    """
+    prev = None
+    for start in range(0, max(part_lengths, default=0), num_measures_per_line):
+        for part_index, length in enumerate(part_lengths):
+            stop = min(start + num_measures_per_line, length)
+            yield part_index, min(start, length), stop, prev
+            if stop > start:
+                prev = (part_index, stop - 1)
+        yield None
+
+_render_state = None  # (writer, measures of every part) of a worker process
+
+def _initRenderWorker(writer, part_measures):
+    global _render_state
+    _render_state = (writer, part_measures)
+
+def _renderBatch(lines):
+    writer, part_measures = _render_state
+    texts = []
+    for part_index, start, stop, prev in lines:
+        prev_measure = None
+        if prev is not None:
+            prev_measure = part_measures[prev[0]][prev[1]]
+        texts.append(writer.generateMeasures(part_measures[part_index][start:stop],
+                                             prev_measure))
+    return texts
+
+def renderLinesParallel(writer, part_measures, num_measures_per_line, workers):
+    """ yield what writer.renderLines() would, rendering on worker processes
+
+    Workers receive the writer and the measures once, when they start (by
+    fork where available, so nothing is copied); tasks only carry line
+    positions, and the rendered texts come back in order.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    context = None
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    lines = iterLinePlan([len(measures) for measures in part_measures],
+                         num_measures_per_line)
+    with ProcessPoolExecutor(workers, context, initializer=_initRenderWorker,
+                             initargs=(writer, part_measures)) as executor:
+        pending = collections.deque()  # (lines, future of their texts)
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= RENDER_BATCH_LINES:
+                pending.append(_submitBatch(executor, batch))
+                batch = []
+                while len(pending) > workers * 2:
+                    yield from _collectBatch(*pending.popleft())
+        if batch:
+            pending.append(_submitBatch(executor, batch))
+        while pending:
+            yield from _collectBatch(*pending.popleft())
+
+def _submitBatch(executor, batch):
+    return batch, executor.submit(_renderBatch, list(filter(None, batch)))
+
+def _collectBatch(batch, future):
+    texts = iter(future.result())
+    for line in batch:
+        if line is None:
+            yield None, None
+        else:
+            yield line[0], next(texts)
+
 def getGrammars():
     return 'jianpu99', 'jianpu-ly'
 